@@ -1 +1,3 @@
 __version__ = '0.5.3'
+
+default_app_config = 'telegrambot.apps.TelegramBotConfig'
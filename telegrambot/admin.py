@@ -1,9 +1,94 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from telegrambot.models import Message, Chat, Update, User, Bot, AuthToken
 
-admin.site.register(Message)
-admin.site.register(Chat)
-admin.site.register(User)
-admin.site.register(Update)
-admin.site.register(Bot)
-admin.site.register(AuthToken)
\ No newline at end of file
+ESTIMATE_THRESHOLD = getattr(settings, 'TELEGRAM_BOT_ADMIN_ESTIMATE_THRESHOLD', 100000)
+
+
+def estimated_rows(connection, table):
+    """
+    Rows of ``table`` estimated by the PostgreSQL planner, ``None`` on other databases.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE relname = %s", [table])
+        row = cursor.fetchone()
+    return int(row[0]) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner estimate of the table rows instead of ``COUNT(*)`` for unfiltered lists of
+    tables with more than ``TELEGRAM_BOT_ADMIN_ESTIMATE_THRESHOLD`` rows. Only PostgreSQL gives
+    estimates, other databases count.
+    """
+
+    def estimate(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where:
+            return None
+        return estimated_rows(connections[queryset.db], queryset.model._meta.db_table)
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is not None and estimate > ESTIMATE_THRESHOLD:
+            return estimate
+        try:
+            return self.object_list.count()
+        except (AttributeError, TypeError):
+            return len(self.object_list)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Message)
+class MessageAdmin(LargeTableAdmin):
+    list_display = ('message_id', 'date', 'chat', 'from_user', 'text')
+    list_select_related = ('chat', 'from_user')
+    raw_id_fields = ('from_user', 'chat', 'forward_from')
+    date_hierarchy = 'date'
+    search_fields = ('=message_id', )
+
+
+@admin.register(Update)
+class UpdateAdmin(LargeTableAdmin):
+    list_display = ('update_id', 'message')
+    list_select_related = ('message', 'message__from_user')
+    raw_id_fields = ('message', )
+    search_fields = ('=update_id', )
+
+
+@admin.register(Chat)
+class ChatAdmin(LargeTableAdmin):
+    list_display = ('id', 'type', 'title', 'username', 'first_name', 'last_name')
+    search_fields = ('=id', 'username', 'title')
+
+
+@admin.register(User)
+class UserAdmin(LargeTableAdmin):
+    list_display = ('id', 'first_name', 'last_name', 'username')
+    search_fields = ('=id', 'username', 'first_name')
+
+
+@admin.register(Bot)
+class BotAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'token', 'enabled', 'created')
+    list_select_related = ('user_api', )
+    list_filter = ('enabled', )
+    raw_id_fields = ('user_api', )
+
+
+@admin.register(AuthToken)
+class AuthTokenAdmin(LargeTableAdmin):
+    list_display = ('key', 'user', 'chat_api', 'created')
+    list_select_related = ('user', 'chat_api')
+    raw_id_fields = ('user', 'chat_api')
+    date_hierarchy = 'created'
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+
+
+class TelegramBotConfig(AppConfig):
+    name = 'telegrambot'
+    verbose_name = _('Telegram Bot')
+
+    def ready(self):
+        from telegrambot import auth_cache, registry  # noqa: connects the token signals
+        if getattr(settings, 'TELEGRAM_BOT_REGISTRY_WARMUP', True):
+            registry.warm_registry()
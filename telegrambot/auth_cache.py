@@ -0,0 +1,65 @@
+"""
+Authentication state of chats for ``login_required``, kept in the Django cache.
+
+The creation date of the token linked to each chat, or ``0`` if there is none, is cached under
+the chat id so checking a chat normally costs no query. Expiration is computed when checking, as
+``AuthToken.expired`` does. Entries are invalidated when a token
+is linked by ``/start``, saved or deleted.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from telegrambot.models import AuthToken
+from telegrambot.models.auth import expiration_date
+
+TIMEOUT = getattr(settings, 'TELEGRAM_BOT_AUTH_CACHE_TIMEOUT', 3600)
+
+
+def get_cache():
+    return caches[getattr(settings, 'TELEGRAM_BOT_AUTH_CACHE', 'default')]
+
+
+def cache_key(chat_id):
+    return 'telegrambot:auth:%s' % chat_id
+
+
+def token_created(chat_id):
+    """
+    Creation date of the token linked to the chat, ``0`` if there is none.
+    """
+    cache = get_cache()
+    created = cache.get(cache_key(chat_id))
+    if created is None:
+        created = AuthToken.objects.filter(chat_api_id=chat_id).values_list('created', flat=True).first() or 0
+        cache.set(cache_key(chat_id), created, TIMEOUT)
+    return created
+
+
+def is_authenticated(chat_id):
+    created = token_created(chat_id)
+    return bool(created) and not created < expiration_date()
+
+
+def invalidate(*chat_ids):
+    """
+    Forget the state of ``chat_ids``, once the current transaction is committed if there is one.
+    """
+    chat_ids = [chat_id for chat_id in chat_ids if chat_id is not None]
+    if not chat_ids:
+        return
+
+    def delete():
+        get_cache().delete_many([cache_key(chat_id) for chat_id in chat_ids])
+    delete()
+    using = router.db_for_write(AuthToken)
+    if connections[using].in_atomic_block:
+        #  Readers may cache the old state again before the commit
+        transaction.on_commit(delete, using=using)
+
+
+@receiver(post_save, sender=AuthToken)
+@receiver(post_delete, sender=AuthToken)
+def invalidate_token(sender, instance, **kwargs):
+    invalidate(instance.chat_api_id)
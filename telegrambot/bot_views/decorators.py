@@ -1,5 +1,5 @@
 from functools import wraps
-from telegrambot.models import Chat, Bot
+from telegrambot.auth_cache import is_authenticated
 from django.core.urlresolvers import reverse
 
 
@@ -10,12 +10,10 @@ def login_required(view_func):
     """
     @wraps(view_func)
     def wrapper(bot, update, **kwargs):
-        chat = Chat.objects.get(id=update.message.chat.id)
-        if chat.is_authenticated():
+        if is_authenticated(update.message.chat.id):
             return view_func(bot, update, **kwargs)
         from telegrambot.bot_views.login import LoginBotView
         login_command_view = LoginBotView.as_command_view()
-        bot_model = Bot.objects.get(token=bot.token)
-        kwargs['link'] = reverse('telegrambot:auth', kwargs={'bot': bot_model.user_api.username}) 
+        kwargs['link'] = reverse('telegrambot:auth', kwargs={'bot': bot.user_api.username}) 
         return login_command_view(bot, update, **kwargs)
     return wrapper
\ No newline at end of file
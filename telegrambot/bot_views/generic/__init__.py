@@ -2,4 +2,5 @@ from telegrambot.bot_views.generic.base import TemplateCommandView  # noqa
 from telegrambot.bot_views.generic.compound import ListDetailCommandView  # noqa
 from telegrambot.bot_views.generic.detail import DetailCommandView  # noqa
 from telegrambot.bot_views.generic.list import ListCommandView  # noqa
-from telegrambot.bot_views.generic.responses import (TextResponse, KeyboardResponse)  # noqa
\ No newline at end of file
+from telegrambot.bot_views.generic.responses import (TextResponse, KeyboardResponse)  # noqa
+from telegrambot.bot_views.generic.keyboards import Keyboard, StaticKeyboard, CommandKeyboard  # noqa
\ No newline at end of file
@@ -1,4 +1,5 @@
-from telegrambot.bot_views.generic.responses import TextResponse, KeyboardResponse
+from telegrambot.bot_views.generic.responses import TextResponse, KeyboardResponse, keyboard_markup
+from telegrambot.bot_views.generic.caching import get_response_cache
 from telegram import ParseMode
 import sys
 import traceback
@@ -10,15 +11,59 @@ PY3 = sys.version_info > (3,)
 class TemplateCommandView(object):
     template_text = None
     template_keyboard = None    
+    use_context_processors = False
+    keyboard = None
+    context_free = False
+    cache_response = False
+    response_cache_timeout = 300
     
     def get_context(self, bot, update, **kwargs):
         return None    
+    
+    def get_response_cache_key(self, ctx):
+        """
+        Key of the cached response for ``ctx``, or None to render it. Context free views share one
+        response, override to cache by context.
+        """
+        if self.context_free:
+            return 'response'
+        return None
+    
+    def get_response(self, ctx):
+        """
+        Rendered text and keyboard markup, from the view response cache when ``cache_response`` is set.
+        """
+        key = self.get_response_cache_key(ctx) if self.cache_response else None
+        if key is None:
+            return self.render(ctx)
+        cache = get_response_cache(self.__class__)
+        response = cache.get(key)
+        if response is None:
+            response = self.render(ctx)
+            cache.set(key, response, self.response_cache_timeout)
+        return response
+    
+    def render(self, ctx):
+        text = TextResponse(self.template_text, ctx, self.use_context_processors).render()
+        rows = self.get_keyboard(ctx)
+        if rows is None:
+            keyboard = KeyboardResponse(self.template_keyboard, ctx, self.use_context_processors).render()
+        else:
+            keyboard = keyboard_markup(rows)
+        return text, keyboard
+    
+    def get_keyboard(self, ctx):
+        """
+        Rows of the reply keyboard, or None to render ``template_keyboard``.
+        """
+        if self.keyboard is not None:
+            return self.keyboard.rows(ctx)
+        return None
 
     def handle(self, bot, update, **kwargs):
         try:
-            ctx = self.get_context(bot, update, **kwargs)
-            text = TextResponse(self.template_text, ctx).render()
-            keyboard = KeyboardResponse(self.template_keyboard, ctx).render()       
+            ctx = None if self.context_free else self.get_context(bot, update, **kwargs)
+            text, keyboard = self.get_response(ctx)
 #             logger.debug("Text:" + str(text.encode('utf-8')))
 #             logger.debug("Keyboard:" + str(keyboard))
             if text:
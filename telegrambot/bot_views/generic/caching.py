@@ -0,0 +1,114 @@
+"""
+Caching of objects looked up by detail command views and of rendered responses.
+
+Object cache keys include a generation number per model kept in the same cache backend. Saving or deleting an
+instance of the model bumps it, which invalidates every object and miss cached for that model.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_save, post_delete
+from django.utils.encoding import force_bytes
+from telegrambot.utils import LRUCache
+import hashlib
+import threading
+import time
+
+#  Cached in place of objects that do not exist
+DOES_NOT_EXIST = 'telegrambot:does-not-exist'
+
+_connected = set()
+_connected_lock = threading.Lock()
+
+
+def generation_key(model):
+    return 'telegrambot:generation:%s' % model._meta.label_lower
+
+
+def new_generation():
+    #  Not reusing numbers of an evicted generation key
+    return int(time.time() * 1000)
+
+
+def get_generation(cache, model):
+    generation = cache.get(generation_key(model))
+    if generation is None:
+        cache.add(generation_key(model), new_generation(), None)
+        generation = cache.get(generation_key(model))
+    return generation
+
+
+def bump_generation(cache, model):
+    try:
+        cache.incr(generation_key(model))
+    except ValueError:
+        cache.add(generation_key(model), new_generation(), None)
+
+
+def object_cache_key(cache, view_class, model, slug_field, slug):
+    return 'telegrambot:object:%s:%s.%s:%s:%s:%s' % (
+        model._meta.label_lower, view_class.__module__, view_class.__name__, get_generation(cache, model),
+        slug_field, hashlib.md5(force_bytes(slug)).hexdigest())
+
+
+def watch_model(model, cache_alias):
+    """
+    Invalidate the objects of ``model`` cached in ``cache_alias`` when an instance is saved or deleted.
+    """
+    with _connected_lock:
+        if (model, cache_alias) in _connected:
+            return
+        _connected.add((model, cache_alias))
+
+    def invalidate(sender, **kwargs):
+        bump_generation(caches[cache_alias], model)
+    uid = 'telegrambot.detail.%s.%s' % (model._meta.label_lower, cache_alias)
+    post_save.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+
+
+class ResponseCache(object):
+    """
+    In-process cache of rendered responses with a timeout per entry and hit/miss counters.
+    """
+
+    def __init__(self, maxsize=1024):
+        self._data = LRUCache(maxsize)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is not None and (entry[0] is None or entry[0] > time.time()):
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, value, timeout=None):
+        self._data.set(key, (None if timeout is None else time.time() + timeout, value))
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+_response_caches = {}
+
+
+def get_response_cache(view_class):
+    """
+    Response cache of ``view_class``, sized by ``TELEGRAM_BOT_RESPONSE_CACHE_SIZE``.
+    """
+    try:
+        return _response_caches[view_class]
+    except KeyError:
+        size = getattr(settings, 'TELEGRAM_BOT_RESPONSE_CACHE_SIZE', 1024)
+        return _response_caches.setdefault(view_class, ResponseCache(size))
+
+
+def clear_response_caches():
+    for cache in list(_response_caches.values()):
+        cache.clear()
@@ -1,4 +1,5 @@
 from telegrambot.bot_views.generic.base import TemplateCommandView
+from telegrambot.bot_views.generic.list import is_cursor
 
 class ListDetailCommandView(TemplateCommandView):
     list_view_class = None
@@ -8,7 +9,9 @@ class ListDetailCommandView(TemplateCommandView):
     def as_command_view(cls, **initkwargs):
         def view(bot, update, **kwargs):
             command_args = update.message.text.split(' ')
-            if len(command_args) > 1:
+            if len(command_args) > 1 and is_cursor(command_args[1]):
+                self = cls.list_view_class(command_args[1])
+            elif len(command_args) > 1:
                 self = cls.detail_view_class(command_args[1])
             else:
                 self = cls.list_view_class()
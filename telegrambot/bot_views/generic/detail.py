@@ -1,12 +1,31 @@
 from telegrambot.bot_views.generic.base import TemplateCommandView
+from telegrambot.bot_views.generic.caching import DOES_NOT_EXIST, object_cache_key, watch_model
+from django.core.cache import caches
 from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist,\
     FieldError
+from django.utils import six
 
-class DetailCommandView(TemplateCommandView):
+
+class DetailCommandViewBase(type):
+    """
+    Connects the cache invalidation of views with ``cache_timeout`` when they are defined, so saves in
+    processes that never ran the view invalidate it too.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(DetailCommandViewBase, cls).__init__(name, bases, attrs)
+        model = cls.model or getattr(cls.queryset, 'model', None)
+        if cls.cache_timeout and model is not None:
+            watch_model(model, cls.cache_alias)
+
+
+class DetailCommandView(six.with_metaclass(DetailCommandViewBase, TemplateCommandView)):
     model = None
     queryset = None
     context_object_name = None
     slug_field = 'slug'    
+    cache_timeout = None
+    cache_alias = 'default'
     
     def __init__(self, slug=None):
         self.slug = slug
@@ -39,6 +58,33 @@ class DetailCommandView(TemplateCommandView):
     def get_slug(self, **kwargs):
         return self.slug
     
+    def get_object(self, queryset, slug_field, slug):
+        """
+        Look the object up by slug, or in the cache when ``cache_timeout`` is set. Returns None
+        if it does not exist.
+        """
+        if not self.cache_timeout:
+            return self.lookup(queryset, slug_field, slug)
+        cache = caches[self.cache_alias]
+        #  Models of overridden get_queryset are only known here
+        watch_model(queryset.model, self.cache_alias)
+        key = object_cache_key(cache, self.__class__, queryset.model, slug_field, slug)
+        object = cache.get(key)
+        if object is None:
+            object = self.lookup(queryset, slug_field, slug)
+            cache.set(key, DOES_NOT_EXIST if object is None else object, self.cache_timeout)
+        elif object == DOES_NOT_EXIST:
+            object = None
+        return object
+    
+    def lookup(self, queryset, slug_field, slug):
+        try:
+            return queryset.get(**{slug_field: slug})
+        except FieldError:
+            raise FieldError("Field %s not in valid. Review slug_field" % slug_field)
+        except ObjectDoesNotExist:
+            return None
+    
     def get_context(self, bot, update, **kwargs):
         queryset = self.get_queryset()
         if not self.slug_field: 
@@ -48,12 +94,7 @@ class DetailCommandView(TemplateCommandView):
         slug_field = self.get_slug_field(**kwargs)
         slug = self.get_slug(**kwargs)
         if slug:
-            try:
-                object = queryset.get(**{slug_field: slug})
-            except FieldError:
-                raise FieldError("Field %s not in valid. Review slug_field" % slug_field)
-            except ObjectDoesNotExist:
-                object = None
+            object = self.get_object(queryset, slug_field, slug)
         else: 
             object = None
         context = {'context_object_name': object}
@@ -0,0 +1,86 @@
+from telegrambot.utils import LRUCache
+from django.utils import six
+
+
+def group(flat, size):
+    """
+    Split ``flat`` in rows of ``size`` elements.
+    """
+    flat = list(flat)
+    return [flat[i:i + size] for i in range(0, len(flat), size)]
+
+
+def command_rows(objects, command, field='slug', per_line=1):
+    """
+    Rows of ``/command <field>`` buttons, one button for each object.
+    """
+    return [["/%s %s" % (command, getattr(element, field)) for element in line]
+            for line in group(objects, int(per_line))]
+
+
+class Keyboard(object):
+    """
+    Builds the rows of a reply keyboard from a view context.
+
+    With ``key`` (a context variable name or a callable taking the context) rows are memoized per
+    key value, so contexts with the same key share the rows built for the first one. Memoized rows
+    must not be modified.
+    """
+
+    def __init__(self, key=None, cache_size=128):
+        self.key = key
+        self._cache = LRUCache(cache_size)
+
+    def get_key(self, ctx):
+        if self.key is None:
+            return None
+        if callable(self.key):
+            return self.key(ctx)
+        return ctx.get(self.key)
+
+    def build(self, ctx):
+        raise NotImplementedError
+
+    def rows(self, ctx):
+        ctx = ctx or {}
+        key = self.get_key(ctx)
+        if key is None:
+            return self.build(ctx)
+        rows = self._cache.get(key)
+        if rows is None:
+            rows = self.build(ctx)
+            self._cache.set(key, rows)
+        return rows
+
+    def clear(self):
+        self._cache.clear()
+
+
+class StaticKeyboard(Keyboard):
+    """
+    Same rows for every context.
+    """
+
+    def __init__(self, rows):
+        super(StaticKeyboard, self).__init__()
+        self._rows = [[six.text_type(button) for button in row] for row in rows]
+
+    def build(self, ctx):
+        return self._rows
+
+
+class CommandKeyboard(Keyboard):
+    """
+    One ``/command <field>`` button for each object in the ``source`` context variable, the
+    native version of the ``keyboard_field`` template filter.
+    """
+
+    def __init__(self, command, source, field='slug', per_line=1, **kwargs):
+        super(CommandKeyboard, self).__init__(**kwargs)
+        self.command = command
+        self.source = source
+        self.field = field
+        self.per_line = per_line
+
+    def build(self, ctx):
+        return command_rows(ctx.get(self.source) or [], self.command, self.field, self.per_line)
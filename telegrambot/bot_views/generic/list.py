@@ -1,14 +1,59 @@
 from telegrambot.bot_views.generic.base import TemplateCommandView
+from telegrambot.bot_views.generic.responses import KeyboardResponse
 from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
 from django.db.models.query import QuerySet
 from django.utils import six
+import base64
+import json
+
+NEXT = '>'
+PREVIOUS = '<'
+
+
+def encode_cursor(direction, values):
+    """
+    Token for the page after (``NEXT``) or before (``PREVIOUS``) the row with ordering ``values``.
+    """
+    data = json.dumps(values, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8')
+    return direction + base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Return ``(direction, values)`` of a cursor token. Raises ``ValueError`` if it is not valid.
+    """
+    if not token or token[0] not in (NEXT, PREVIOUS):
+        raise ValueError("Not a cursor: %s" % token)
+    data = token[1:]
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(data + '=' * (-len(data) % 4))).decode('utf-8'))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Not a cursor: %s (%s)" % (token, e))
+    if not isinstance(values, list):
+        raise ValueError("Not a cursor: %s" % token)
+    return token[0], values
+
+
+def is_cursor(token):
+    try:
+        decode_cursor(token)
+    except ValueError:
+        return False
+    return True
+
 
 class ListCommandView(TemplateCommandView):
     queryset = None
     context_object_name = None
     model = None
     ordering = None
-    
+    paginate_by = None
+
+    def __init__(self, cursor=None):
+        self.cursor = cursor
+
     def get_queryset(self):
         if self.queryset is not None:
             queryset = self.queryset
@@ -30,16 +75,129 @@ class ListCommandView(TemplateCommandView):
                 ordering = (ordering,)
             queryset = queryset.order_by(*ordering)
         return queryset
-    
+
     def get_ordering(self):
         """
         Return the field or fields to use for ordering the queryset.
         """
         return self.ordering
-    
+
+    def get_paginate_by(self):
+        return self.paginate_by
+
+    def get_keyset(self):
+        """
+        Fields the pages are sought on: the ordering fields and the primary key as tie-breaker.
+        """
+        ordering = self.get_ordering() or ()
+        if isinstance(ordering, six.string_types):
+            ordering = (ordering,)
+        keyset = list(ordering)
+        if not set(('pk', '-pk')) & set(keyset):
+            keyset.append('pk')
+        return keyset
+
+    def seek(self, queryset, keyset, values, direction):
+        """
+        Filter ``queryset`` to the rows after (or before) the row with ``values`` for ``keyset``.
+        """
+        condition = Q()
+        for index, field in enumerate(keyset):
+            name = field.lstrip('-')
+            forward = field.startswith('-') == (direction == PREVIOUS)
+            step = Q(**{'%s__%s' % (name, 'gt' if forward else 'lt'): values[index]})
+            for previous, value in zip(keyset[:index], values):
+                step &= Q(**{previous.lstrip('-'): value})
+            condition |= step
+        return queryset.filter(condition)
+
+    def get_cursor(self, update):
+        """
+        Cursor the view was built with, else the argument of the command if it is a cursor.
+        """
+        if self.cursor is not None:
+            return self.cursor
+        command_args = update.message.text.split(' ')
+        if len(command_args) > 1 and is_cursor(command_args[1]):
+            return command_args[1]
+        return None
+
+    def get_page(self, queryset, paginate_by):
+        """
+        Fetch one page of ``paginate_by`` rows with a single query. Returns the rows and the page
+        information added to the context as ``page``.
+        """
+        keyset = self.get_keyset()
+        try:
+            direction, values = decode_cursor(self.cursor)
+        except ValueError:
+            direction, values = None, None
+        if values is not None and len(values) != len(keyset):
+            direction, values = None, None
+        if direction == PREVIOUS:
+            queryset = queryset.order_by(*[field[1:] if field.startswith('-') else '-' + field
+                                           for field in keyset])
+        else:
+            queryset = queryset.order_by(*keyset)
+        if values is not None:
+            queryset = self.seek(queryset, keyset, values, direction)
+        rows = list(queryset[:paginate_by + 1])
+        more = len(rows) > paginate_by
+        rows = rows[:paginate_by]
+        if direction == PREVIOUS:
+            rows.reverse()
+        has_next = more if direction != PREVIOUS else True
+        has_previous = more if direction == PREVIOUS else direction == NEXT
+
+        def cursor(direction, row):
+            return encode_cursor(direction, [self.keyset_value(row, field) for field in keyset])
+
+        page = {'has_next': bool(rows) and has_next,
+                'has_previous': bool(rows) and has_previous,
+                'next_cursor': None,
+                'previous_cursor': None}
+        if page['has_next']:
+            page['next_cursor'] = cursor(NEXT, rows[-1])
+        if page['has_previous']:
+            page['previous_cursor'] = cursor(PREVIOUS, rows[0])
+        return rows, page
+
+    def keyset_value(self, row, field):
+        value = row
+        for name in field.lstrip('-').split('__'):
+            value = getattr(value, name)
+        return value
+
     def get_context(self, bot, update, **kwargs):
         object_list = self.get_queryset()
         context = {'object_list': object_list}
+        paginate_by = self.get_paginate_by()
+        if paginate_by:
+            self.cursor = self.get_cursor(update)
+            object_list, page = self.get_page(object_list, paginate_by)
+            command = update.message.text.split(' ')[0]
+            page['next'] = page['next_cursor'] and "%s %s" % (command, page['next_cursor'])
+            page['previous'] = page['previous_cursor'] and "%s %s" % (command, page['previous_cursor'])
+            context.update(object_list=object_list, page=page)
         if self.context_object_name:
             context[self.context_object_name] = object_list
-        return context
\ No newline at end of file
+        return context
+
+    def get_navigation(self, ctx):
+        """
+        Row with the previous and next page buttons.
+        """
+        page = (ctx or {}).get('page')
+        if not page:
+            return []
+        return [button for button in (page['previous'], page['next']) if button]
+
+    def get_keyboard(self, ctx):
+        rows = super(ListCommandView, self).get_keyboard(ctx)
+        navigation = self.get_navigation(ctx)
+        if not navigation:
+            return rows
+        if rows is None:
+            markup = KeyboardResponse(self.template_keyboard, ctx, self.use_context_processors).render()
+            rows = list(getattr(markup, 'keyboard', None) or [])
+        return rows + [navigation]
@@ -1,4 +1,7 @@
-from django.template import RequestContext, TemplateDoesNotExist
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template import TemplateDoesNotExist
 from django.template.loader import get_template
 from telegram import ReplyKeyboardMarkup, ReplyKeyboardHide
 import ast
@@ -7,43 +10,81 @@ from django.http.request import HttpRequest
 
 logger = logging.getLogger(__name__)
 
+#  Compiled templates by name, None for templates that do not exist
+_templates = {}
+
+
+def load_template(template_name):
+    """
+    Compiled template for ``template_name`` or ``None`` if it does not exist. Both results are
+    cached unless ``TELEGRAM_BOT_TEMPLATE_CACHE`` is False (default: not ``DEBUG``).
+    """
+    try:
+        return _templates[template_name]
+    except KeyError:
+        pass
+    try:
+        template = get_template(template_name)
+    except TemplateDoesNotExist:
+        logger.debug("Template not found: %s", template_name)
+        template = None
+    if getattr(settings, 'TELEGRAM_BOT_TEMPLATE_CACHE', not settings.DEBUG):
+        _templates[template_name] = template
+    return template
+
+
+def clear_template_cache():
+    _templates.clear()
+
+
+@receiver(setting_changed)
+def template_settings_changed(setting, **kwargs):
+    if setting in ('TEMPLATES', 'TELEGRAM_BOT_TEMPLATE_CACHE', 'DEBUG'):
+        clear_template_cache()
+
+
+def keyboard_markup(rows):
+    """
+    Reply markup for keyboard ``rows``, hiding the keyboard if there are none.
+    """
+    if rows:
+        return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+    return ReplyKeyboardHide()
+
+
 class TemplateResponse(object):
-    
-    def __init__(self, template_name, ctx=None):
+
+    def __init__(self, template_name, ctx=None, use_context_processors=False):
         self.template_name = template_name
         if ctx is None:
             self.ctx = {}
         else:
             self.ctx = ctx
-        
+        self.use_context_processors = use_context_processors
+
     def render(self):
         if not self.template_name:
             return None
-        try:
-            logger.debug("Template name: %s" % self.template_name)
-            template = get_template(self.template_name)      
-        except TemplateDoesNotExist:
-            logger.debug("Template not found: %s" % self.template_name)
+        logger.debug("Template name: %s", self.template_name)
+        template = load_template(self.template_name)
+        if template is None:
             return None
-        # TODO: Avoid using a null HttRequest to context processors
-        ctx = RequestContext(HttpRequest(), self.ctx)
-        return template.render(ctx)
-    
+        if self.use_context_processors:
+            return template.render(self.ctx, request=HttpRequest())
+        return template.render(self.ctx)
+
 class TextResponse(TemplateResponse):
 
-    def __init__(self, template_text, ctx=None):
-        super(TextResponse, self).__init__(template_text, ctx)
-        
+    def __init__(self, template_text, ctx=None, use_context_processors=False):
+        super(TextResponse, self).__init__(template_text, ctx, use_context_processors)
+
 class KeyboardResponse(TemplateResponse):
-    
-    def __init__(self, template_keyboard, ctx=None):
-        super(KeyboardResponse, self).__init__(template_keyboard, ctx)
-        
+
+    def __init__(self, template_keyboard, ctx=None, use_context_processors=False):
+        super(KeyboardResponse, self).__init__(template_keyboard, ctx, use_context_processors)
+
     def render(self):
         keyboard = super(KeyboardResponse, self).render()
         if keyboard:
             keyboard = ast.literal_eval(keyboard)
-            keyboard = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        else:
-            keyboard = ReplyKeyboardHide()
-        return keyboard
\ No newline at end of file
+        return keyboard_markup(keyboard)
@@ -11,6 +11,8 @@ class LoginBotView(TemplateCommandView):
         return 'https://%s%s' % (current_site.domain, link)
     
     def get_bot(self, bot):
+        if isinstance(bot, Bot):
+            return bot
         return Bot.objects.get(token=bot.token)
     
     def get_context(self, bot, update, **kwargs):
@@ -0,0 +1,167 @@
+"""
+Sending one message to many chats.
+
+``BroadcastEngine.run`` streams target chat ids, renders the message once per distinct context and
+sends it from a pool of worker threads limited to ``rate`` messages per second. The outcome for
+each chat is stored in ``BroadcastDelivery`` after every chunk, so running the same broadcast again
+resumes it. Chats that blocked the bot are skipped by its later broadcasts.
+
+Chats are not related to a bot, so the targets are chosen by the caller: every stored chat, or only
+those with an authentication token, for ``telegrambot_broadcast``.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from telegrambot.bot_views.generic.responses import TextResponse, KeyboardResponse
+from telegrambot.ingestion import WorkerPool
+from telegrambot.models import BroadcastDelivery
+from telegrambot.outbound import TokenBucket
+from telegrambot.resilience import CircuitOpen, get_client
+from telegram import ParseMode
+from telegram.error import TelegramError
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_MESSAGES = ('unauthorized', 'forbidden', 'blocked', 'deactivated', 'kicked')
+
+
+def is_blocked(error):
+    """
+    Whether ``error`` means the chat can not receive messages from the bot anymore.
+    """
+    message = (getattr(error, 'message', None) or str(error)).lower()
+    return isinstance(error, TelegramError) and any(word in message for word in BLOCKED_MESSAGES)
+
+
+class BroadcastEngine(object):
+    """
+    ``get_context(chat_id)`` returns the context of the message for a chat, it is only called
+    once for all the chats with the same ``context_key(chat_id)``. Without them every chat gets
+    the same message.
+    """
+
+    def __init__(self, broadcast, get_context=None, context_key=None, workers=4, rate=30, chunk_size=100):
+        self.broadcast = broadcast
+        self.bot = broadcast.bot
+        self.get_context = get_context or (lambda chat_id: {})
+        self.context_key = context_key or (lambda chat_id: None)
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.aborted = False
+        self._bucket = TokenBucket(rate)
+        self._lock = threading.Lock()
+        self._rendered = {}
+        self._results = []
+
+    def render(self, chat_id):
+        key = self.context_key(chat_id)
+        with self._lock:
+            if key in self._rendered:
+                return self._rendered[key]
+        ctx = self.get_context(chat_id)
+        text = TextResponse(self.broadcast.template_text, ctx).render()
+        keyboard = KeyboardResponse(self.broadcast.template_keyboard, ctx).render()
+        with self._lock:
+            return self._rendered.setdefault(key, (text, keyboard))
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                wait = self._bucket.wait(time.time())
+                if not wait:
+                    self._bucket.consume(time.time())
+                    return
+            time.sleep(wait)
+
+    def send(self, chat_id):
+        if self.aborted:
+            return
+        text, keyboard = self.render(chat_id)
+        self.acquire()
+        try:
+            client = get_client(self.bot.token, max_wait=None)
+            client.call(self.bot._bot.sendMessage, chat_id=chat_id, text=text,
+                        reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+        except CircuitOpen:
+            self.aborted = True
+            return
+        except Exception as e:
+            status = BroadcastDelivery.BLOCKED if is_blocked(e) else BroadcastDelivery.FAILED
+            self._results.append((chat_id, status, "%s" % e))
+        else:
+            self._results.append((chat_id, BroadcastDelivery.SENT, ''))
+
+    def skipped_chats(self, chat_ids):
+        """
+        Chats in ``chat_ids`` already reached by this broadcast or that blocked the bot.
+        """
+        reached = Q(broadcast=self.broadcast) & ~Q(status=BroadcastDelivery.FAILED)
+        blocked = Q(broadcast__bot=self.bot, status=BroadcastDelivery.BLOCKED)
+        return set(BroadcastDelivery.objects.filter(reached | blocked, chat_id__in=chat_ids)
+                   .values_list('chat_id', flat=True))
+
+    def exclude_blocked(self, chats):
+        """
+        ``chats`` queryset without the chats that blocked the bot, in a subquery.
+        """
+        blocked = BroadcastDelivery.objects.filter(broadcast__bot=self.bot, status=BroadcastDelivery.BLOCKED)
+        return chats.exclude(id__in=blocked.values('chat_id'))
+
+    def record(self, results):
+        chat_ids = [chat_id for chat_id, _, _ in results]
+        with transaction.atomic():
+            BroadcastDelivery.objects.filter(broadcast=self.broadcast, chat_id__in=chat_ids).delete()
+            BroadcastDelivery.objects.bulk_create(
+                [BroadcastDelivery(broadcast=self.broadcast, chat_id=chat_id, status=status, error=error)
+                 for chat_id, status, error in results])
+
+    def run(self, chat_ids):
+        """
+        Send the broadcast to every chat id of the iterable ``chat_ids``, such as
+        ``queryset.values_list('id', flat=True).iterator()``. Returns the counters of the run.
+        """
+        stats = {BroadcastDelivery.SENT: 0, BroadcastDelivery.FAILED: 0, BroadcastDelivery.BLOCKED: 0,
+                 'skipped': 0}
+        start = time.time()
+        #  An invalid token is refused as chats that blocked the bot are, fail before marking them
+        get_client(self.bot.token, max_wait=None).call(self.bot._bot.getMe)
+        pool = WorkerPool(workers=self.workers, queue_size=self.chunk_size, target=self.send)
+        pool.start()
+        try:
+            chunk = []
+            for chat_id in chat_ids:
+                chunk.append(chat_id)
+                if len(chunk) >= self.chunk_size:
+                    self.run_chunk(pool, chunk, stats)
+                    chunk = []
+                if self.aborted:
+                    break
+            if chunk and not self.aborted:
+                self.run_chunk(pool, chunk, stats)
+        finally:
+            pool.stop()
+        if not self.aborted:
+            self.broadcast.finished = timezone.now()
+            self.broadcast.save(update_fields=['finished'])
+        stats['elapsed'] = time.time() - start
+        stats['rate'] = stats[BroadcastDelivery.SENT] / stats['elapsed'] if stats['elapsed'] else 0
+        stats['aborted'] = self.aborted
+        logger.info("Broadcast %s: %s" % (self.broadcast.pk, stats))
+        return stats
+
+    def run_chunk(self, pool, chunk, stats):
+        skipped = self.skipped_chats(chunk)
+        for chat_id in chunk:
+            if chat_id in skipped:
+                stats['skipped'] += 1
+            else:
+                pool.queue.put((chat_id,))
+        pool.join()
+        results, self._results = self._results, []
+        for _, status, _ in results:
+            stats[status] += 1
+        if results:
+            self.record(results)
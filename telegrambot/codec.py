@@ -0,0 +1,27 @@
+"""
+JSON codec used for webhook payloads. Uses ``orjson`` when it is installed and the standard
+library ``json`` module otherwise.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj):
+    """
+    Serialize ``obj`` to a JSON text string.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj)
@@ -0,0 +1,71 @@
+"""
+Suppression of updates Telegram delivers again after a webhook timeout or error.
+
+Updates are recognized by ``(bot token, update_id)`` in a bounded in-memory LRU and, when
+``TELEGRAM_BOT_DEDUPLICATION['cache']`` names a cache alias, in that shared cache backend too.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from telegrambot.utils import LRUCache
+import hashlib
+import threading
+
+
+class UpdateDeduplicator(object):
+
+    def __init__(self, size=10000, cache=None, timeout=86400):
+        self.seen = LRUCache(size)
+        self.cache_alias = cache
+        self.timeout = timeout
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def key(self, token, update_id):
+        #  Do not leak bot tokens into the cache backend
+        return 'telegrambot:update:%s:%s' % (hashlib.md5(token.encode('utf-8')).hexdigest(), update_id)
+
+    def claim(self, token, update_id):
+        """
+        Return ``True`` the first time an update is seen, ``False`` for a duplicate.
+        """
+        key = self.key(token, update_id)
+        with self._lock:
+            duplicate = key in self.seen
+            if not duplicate:
+                self.seen.set(key, True)
+        if not duplicate and self.cache_alias and not caches[self.cache_alias].add(key, True, self.timeout):
+            #  Claimed by another process, which may still release it
+            self.seen.delete(key)
+            duplicate = True
+        if duplicate:
+            with self._lock:
+                self.duplicates += 1
+            return False
+        return True
+
+    def release(self, token, update_id):
+        """
+        Forget an update that could not be processed so a redelivery is handled.
+        """
+        key = self.key(token, update_id)
+        self.seen.delete(key)
+        if self.cache_alias:
+            caches[self.cache_alias].delete(key)
+
+
+_deduplicator = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator():
+    """
+    Return the process wide deduplicator, or ``None`` if ``TELEGRAM_BOT_DEDUPLICATION`` is ``False``.
+    """
+    global _deduplicator
+    options = getattr(settings, 'TELEGRAM_BOT_DEDUPLICATION', {})
+    if options is False:
+        return None
+    with _deduplicator_lock:
+        if _deduplicator is None:
+            _deduplicator = UpdateDeduplicator(**options)
+        return _deduplicator
@@ -2,4 +2,4 @@ from telegrambot.handlers.conf import command  # noqa
 from telegrambot.handlers.conf import message  # noqa
 from telegrambot.handlers.conf import regex  # noqa
 from telegrambot.handlers.conf import unknown_command  # noqa
-from telegrambot.handlers.resolver import HandlerResolver, HandlerNotFound  # noqa
\ No newline at end of file
+from telegrambot.handlers.resolver import HandlerResolver, HandlerNotFound, get_resolver, clear_resolver_cache  # noqa
\ No newline at end of file
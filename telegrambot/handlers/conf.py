@@ -1,7 +1,10 @@
 from django.conf.urls import url
 
 def command(command, view):
-    return url(r'^/%s(\s)*(?P<param>\w*)' % command, view)
+    pattern = url(r'^/%s(\s)*(?P<param>\w*)' % command, view)
+    #  Used by HandlerResolver to dispatch commands without regex
+    pattern.command = command
+    return pattern
 
 def unknown_command(view):
     return url(r'^/(?P<unknown_command>\w+).*', view)
@@ -1,18 +1,147 @@
 from django.core.urlresolvers import RegexURLResolver
 from django.core.urlresolvers import Resolver404
+from django.core.urlresolvers import ResolverMatch
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+import threading
 
 class HandlerNotFound(Exception):
     pass
 
 
+def is_word(char):
+    return char.isalnum() or char == '_'
+
+
+def parse_command(text):
+    """
+    Split ``/name[@botname] param`` into ``(name, param)``, where ``param`` is the first word
+    after the command as captured by ``command()`` patterns. Returns ``(None, None)`` if
+    ``text`` is not a command.
+    """
+    if not text or text[0] != '/':
+        return None, None
+    length = len(text)
+    end = 1
+    while end < length and is_word(text[end]):
+        end += 1
+    name = text[1:end]
+    if not name:
+        return None, None
+    if end < length and text[end] == '@':
+        end += 1
+        while end < length and is_word(text[end]):
+            end += 1
+    while end < length and text[end].isspace():
+        end += 1
+    start = end
+    while end < length and is_word(text[end]):
+        end += 1
+    return name, text[start:end]
+
+
+def pattern_command(pattern):
+    command = getattr(pattern, 'command', None)
+    if command and all(is_word(char) for char in command):
+        return command
+    return None
+
+
 class HandlerResolver(object):
+    """
+    Resolves the handler of an update. Texts that exactly name a ``command()`` are dispatched
+    through a dict, other texts are matched against the patterns in order.
+    """
     
     def __init__(self, conf):
         self.resolver = RegexURLResolver(r'^', conf)
+        self._commands = None
+        self._non_commands = None
+        self._lock = threading.Lock()
+        
+    def build(self):
+        """
+        Map each command name to the pattern that wins for it in first-match order, and the
+        number of non command patterns declared before that one, which still have to be tried first.
+        """
+        patterns = list(self.resolver.url_patterns)
+        first = {}
+        non_commands = []
+        non_commands_before = []
+        for index, pattern in enumerate(patterns):
+            non_commands_before.append(len(non_commands))
+            name = pattern_command(pattern)
+            if name is None:
+                non_commands.append(pattern)
+            elif name not in first:
+                first[name] = index
+        commands = {}
+        for name, index in first.items():
+            # command('foo') also matches '/foobar', so an earlier prefix command wins
+            winner = min(first[name[:end]] for end in range(1, len(name) + 1) if name[:end] in first)
+            commands[name] = (patterns[winner], winner == index, non_commands_before[winner])
+        with self._lock:
+            self._non_commands = non_commands
+            self._commands = commands
+            
+    def match(self, patterns, text):
+        for pattern in patterns:
+            try:
+                resolver_match = pattern.resolve(text)
+            except Resolver404:
+                continue
+            if resolver_match:
+                return resolver_match
+        return None
         
     def resolve(self, update):
-        try:
-            resolver_match = self.resolver.resolve(update.message.text)
+        if self._commands is None:
+            self.build()
+        text = update.message.text
+        name, param = parse_command(text)
+        if name in self._commands:
+            pattern, exact, earlier = self._commands[name]
+            resolver_match = self.match(self._non_commands[:earlier], text)
+            if resolver_match:
+                return resolver_match
+            if exact:
+                kwargs = {'param': param}
+                kwargs.update(pattern.default_args)
+                return ResolverMatch(pattern.callback, (), kwargs, pattern.name)
+            return pattern.resolve(text)
+        if name is None:
+            #  Only texts starting with '/' can match a command
+            resolver_match = self.match(self._non_commands, text)
+        else:
+            resolver_match = self.match(self.resolver.url_patterns, text)
+        if resolver_match:
             return resolver_match
-        except Resolver404:
-            raise HandlerNotFound("No handler configured for  %s" % update.message.text)
\ No newline at end of file
+        raise HandlerNotFound("No handler configured for  %s" % text)
+        
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(conf):
+    """
+    Return the ``HandlerResolver`` for a handlers conf, built once per process.
+    """
+    try:
+        return _resolvers[conf]
+    except KeyError:
+        with _resolvers_lock:
+            if conf not in _resolvers:
+                _resolvers[conf] = HandlerResolver(conf)
+            return _resolvers[conf]
+
+
+def clear_resolver_cache():
+    with _resolvers_lock:
+        _resolvers.clear()
+
+
+@receiver(setting_changed)
+def handlers_conf_changed(sender, setting, **kwargs):
+    if setting == 'TELEGRAM_BOT_HANDLERS_CONF':
+        clear_resolver_cache()
@@ -0,0 +1,199 @@
+"""
+Ingestion of updates received by the webhook.
+
+``TELEGRAM_BOT_INGESTION`` selects how an accepted update is processed:
+
+* ``'sync'`` (default): persisted and handled inside the webhook request.
+* ``'threads'``: handed to a bounded pool of worker threads in the web process.
+* ``'queue'``: stored as a ``QueuedUpdate`` and processed by the ``telegrambot_worker`` command.
+"""
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.six.moves import queue
+from telegrambot.serializers import UpdateSerializer, UpdateDecodeError, decode_update
+from telegrambot.models import Bot, QueuedUpdate
+from telegrambot.registry import registry
+from datetime import timedelta
+import atexit
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SYNC, THREADS, QUEUE = 'sync', 'threads', 'queue'
+
+
+def get_ingestion_mode():
+    return getattr(settings, 'TELEGRAM_BOT_INGESTION', SYNC)
+
+
+def process_update(token, data):
+    """
+    Persist and handle a raw update for the bot with ``token``. Errors of the handler are raised,
+    invalid updates and unknown tokens are only logged.
+    """
+    try:
+        update = decode_update(data)
+    except UpdateDecodeError as e:
+        logger.error("Validation error: %s from message %s" % (e.errors, data))
+        return
+    UpdateSerializer.save_update(update)
+    try:
+        bot = registry.get(token)
+    except Bot.DoesNotExist:
+        logger.warning("Token %s not associated to a bot" % token)
+        return
+    bot.handle(update)
+
+
+class WorkerPool(object):
+    """
+    Bounded queue of updates consumed by a fixed number of worker threads.
+    """
+
+    def __init__(self, workers=4, queue_size=1000, target=process_update):
+        self.workers = workers
+        self.target = target
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.processed = 0
+        self.failed = 0
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run,
+                                          name='telegrambot-worker-%d' % len(self._threads))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the workers once the jobs already queued have run.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+        #  Workers take the lock to count jobs, join them without it
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def submit(self, *args):
+        """
+        Enqueue a job without blocking. Returns ``False`` if the queue is full.
+        """
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            return False
+        return True
+
+    def join(self):
+        self.queue.join()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return {'workers': len(self._threads),
+                'queue_depth': self.qsize(),
+                'queue_size': self.queue.maxsize,
+                'processed': self.processed,
+                'failed': self.failed}
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            try:
+                if args is None:
+                    return
+                close_old_connections()
+                self.run_job(*args)
+                close_old_connections()
+            finally:
+                self.queue.task_done()
+
+    def run_job(self, *args):
+        try:
+            self.target(*args)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            logger.exception("Error processing job %s" % (args,))
+        else:
+            with self._lock:
+                self.processed += 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process wide worker pool, creating and starting it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(workers=int(getattr(settings, 'TELEGRAM_BOT_INGESTION_WORKERS', 4)),
+                               queue_size=int(getattr(settings, 'TELEGRAM_BOT_INGESTION_QUEUE_SIZE', 1000)))
+            _pool.start()
+            #  Updates were already acknowledged to Telegram, process them before exiting
+            atexit.register(_pool.stop)
+        return _pool
+
+
+def enqueue_update(token, data):
+    """
+    Hand a raw update to the configured ingestion backend. Returns ``False`` if it could not be accepted.
+    """
+    mode = get_ingestion_mode()
+    if mode == THREADS:
+        return get_pool().submit(token, data)
+    if mode == QUEUE:
+        QueuedUpdate.objects.create(token=token, payload=json.dumps(data))
+        return True
+    raise ValueError("Ingestion mode %s does not enqueue updates" % mode)
+
+
+def claim_queued_updates(limit):
+    """
+    Claim up to ``limit`` queued updates and return them as ``(pk, token, data)`` tuples.
+
+    Rows claimed concurrently by another worker are skipped. Claims older than
+    ``TELEGRAM_BOT_QUEUE_CLAIM_TIMEOUT`` seconds, left by a worker that died, are taken over. Rows
+    claimed ``TELEGRAM_BOT_QUEUE_MAX_ATTEMPTS`` times are left in the table for inspection.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'TELEGRAM_BOT_QUEUE_CLAIM_TIMEOUT', 300))
+    max_attempts = getattr(settings, 'TELEGRAM_BOT_QUEUE_MAX_ATTEMPTS', 5)
+    claimed = []
+    candidates = (QueuedUpdate.objects.filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale),
+                                              attempts__lt=max_attempts)
+                  .values_list('pk', 'claimed_at')[:limit])
+    for pk, claimed_at in candidates:
+        #  Only one worker sees the claim it read
+        claim = QueuedUpdate.objects.filter(pk=pk, claimed_at=claimed_at)
+        if claim.update(claimed_at=now, attempts=F('attempts') + 1):
+            queued = QueuedUpdate.objects.get(pk=pk)
+            claimed.append((queued.pk, queued.token, json.loads(queued.payload)))
+    return claimed
+
+
+def process_queued_update(pk, token, data):
+    """
+    Process a claimed update, deleting it on success and releasing it for a retry on failure.
+    """
+    try:
+        process_update(token, data)
+    except Exception:
+        QueuedUpdate.objects.filter(pk=pk).update(claimed_at=None)
+        raise
+    QueuedUpdate.objects.filter(pk=pk).delete()
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from telegrambot.broadcast import BroadcastEngine
+from telegrambot.models import Bot, Broadcast, Chat
+
+
+class Command(BaseCommand):
+    help = "Send a message rendered from a template to many chats, or resume a broadcast"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bot', help="Token or id of the sending bot.")
+        parser.add_argument('--template-text', help="Template of the message text.")
+        parser.add_argument('--template-keyboard', default='', help="Template of the message keyboard.")
+        parser.add_argument('--authenticated', action='store_true', default=False,
+                            help="Only chats with an authentication token.")
+        parser.add_argument('--resume', type=int, help="Id of the broadcast to resume, to the chats it was started for.")
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--rate', type=float, default=30, help="Messages per second.")
+        parser.add_argument('--chunk-size', type=int, default=100,
+                            help="Chats sent between two progress saves.")
+
+    def get_broadcast(self, options):
+        if options['resume']:
+            try:
+                broadcast = Broadcast.objects.select_related('bot').get(pk=options['resume'])
+            except Broadcast.DoesNotExist:
+                raise CommandError("Broadcast %s does not exist" % options['resume'])
+            if options['authenticated'] and not broadcast.authenticated_only:
+                raise CommandError("Broadcast %s was started for every chat" % broadcast.pk)
+            return broadcast
+        if not options['bot'] or not options['template_text']:
+            raise CommandError("--bot and --template-text are required for a new broadcast")
+        bots = Bot.objects.filter(token=options['bot'])
+        if options['bot'].isdigit():
+            bots = bots | Bot.objects.filter(pk=options['bot'])
+        bot = bots.first()
+        if bot is None:
+            raise CommandError("Bot %s does not exist" % options['bot'])
+        return Broadcast.objects.create(bot=bot, template_text=options['template_text'],
+                                        template_keyboard=options['template_keyboard'],
+                                        authenticated_only=options['authenticated'])
+
+    def handle(self, *args, **options):
+        broadcast = self.get_broadcast(options)
+        #  Chats are not related to bots, every stored chat is a target
+        chats = Chat.objects.order_by('id')
+        if broadcast.authenticated_only:
+            chats = chats.filter(auth_token__isnull=False)
+        engine = BroadcastEngine(broadcast, workers=options['workers'], rate=options['rate'],
+                                 chunk_size=options['chunk_size'])
+        chats = engine.exclude_blocked(chats)
+        stats = engine.run(chats.values_list('id', flat=True).iterator())
+        self.stdout.write("Broadcast %d%s: %d sent, %d failed, %d blocked, %d skipped in %.1fs (%.1f messages/s)" % (
+            broadcast.pk, " aborted, API unavailable" if stats['aborted'] else "", stats['sent'], stats['failed'],
+            stats['blocked'], stats['skipped'], stats['elapsed'], stats['rate']))
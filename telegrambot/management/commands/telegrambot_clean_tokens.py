@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from telegrambot.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = "Delete the authentication tokens older than TELEGRAM_BOT_TOKEN_EXPIRATION"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="Tokens deleted by each query.")
+        parser.add_argument('--max-batches', type=int, default=None,
+                            help="Stop after this number of batches.")
+
+    def handle(self, *args, **options):
+        deleted = AuthToken.objects.delete_expired(options['batch_size'], options['max_batches'])
+        self.stdout.write("Deleted %d expired tokens" % deleted)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from telegrambot.models import OutboxMessage
+from telegrambot.outbox import drain_outbox
+import time
+
+
+class Command(BaseCommand):
+    help = "Send the messages parked while the Bot API was unavailable"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Parked messages sent on each pass.")
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help="Seconds to wait when nothing could be sent.")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Make a single pass and exit.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                sent = drain_outbox(options['batch_size'])
+                if options['verbosity'] > 1:
+                    self.stdout.write("Sent %d parked messages, %d left" % (sent, OutboxMessage.objects.count()))
+                if options['once']:
+                    break
+                if not sent:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
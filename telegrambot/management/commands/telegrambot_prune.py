@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from telegrambot import retention
+
+
+class Command(BaseCommand):
+    help = "Archive and delete the messages and updates out of the retention policies"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age', type=int, help="Keep messages of the last days.")
+        parser.add_argument('--max-rows', type=int, help="Keep this number of newest messages.")
+        parser.add_argument('--batch-size', type=int, help="Messages archived and deleted by each transaction.")
+        parser.add_argument('--max-batches', type=int, default=None, help="Stop after this number of batches.")
+        parser.add_argument('--archive-dir', help="Directory of the gzipped JSON lines archives.")
+        parser.add_argument('--no-archive', action='store_true', default=False,
+                            help="Delete without archiving.")
+
+    def handle(self, *args, **options):
+        defaults = retention.get_options()
+        for name in ('max_age', 'max_rows', 'batch_size', 'archive_dir'):
+            if options[name] is None:
+                options[name] = defaults[name]
+        if options['max_age'] is None and options['max_rows'] is None:
+            raise CommandError("No retention policy, set --max-age or --max-rows")
+        archive = None
+        if options['archive_dir'] and not options['no_archive']:
+            archive = retention.Archive(retention.archive_path(options['archive_dir']))
+        try:
+            stats = retention.prune(options['max_age'], options['max_rows'], options['batch_size'],
+                                    options['max_batches'], archive)
+        finally:
+            if archive is not None:
+                archive.close()
+        self.stdout.write("Pruned %(messages)d messages and %(updates)d updates" % stats)
+        if archive is not None:
+            self.stdout.write("Archived to %s" % archive.path)
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from telegrambot.ingestion import WorkerPool
+from telegrambot.models import Bot
+from telegrambot.resilience import get_client
+from telegrambot.transport import get_webhook_info
+
+
+class Command(BaseCommand):
+    help = "Compare the webhook of every bot with the one Telegram has and set the different ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help="Only show the differences.")
+        parser.add_argument('--workers', type=int, default=8, help="Bots synced concurrently.")
+
+    def sync(self, bot, url, dry_run):
+        client = get_client(bot.token)
+        try:
+            info = client.call(get_webhook_info, bot._bot)
+            current = (info.get('url') or None, bool(info.get('has_custom_certificate')))
+            if current == (url, bool(url and bot.ssl_certificate)):
+                self.results.append((bot, 'ok', None))
+                return
+            change = "%s -> %s" % (current[0], url)
+            if bot.ssl_certificate and not current[1]:
+                change += " (certificate)"
+            if not dry_run:
+                bot.set_webhook(url)
+            self.results.append((bot, 'changed', change))
+        except Exception as e:
+            self.results.append((bot, 'error', "%s" % e))
+
+    def handle(self, *args, **options):
+        self.results = []
+        pool = WorkerPool(workers=options['workers'], target=self.sync)
+        pool.start()
+        try:
+            for bot in Bot.objects.select_related('user_api').order_by('pk'):
+                #  Urls are built here, workers do not use the database
+                pool.queue.put((bot, bot.get_webhook_url(), options['dry_run']))
+            pool.join()
+        finally:
+            pool.stop()
+        counts = {'ok': 0, 'changed': 0, 'error': 0}
+        for bot, status, detail in sorted(self.results, key=lambda result: result[0].pk):
+            counts[status] += 1
+            if status == 'changed':
+                self.stdout.write("%s %s: %s" % ("Would set" if options['dry_run'] else "Set", bot, detail))
+            elif status == 'error':
+                self.stderr.write("Error syncing %s: %s" % (bot, detail))
+        self.stdout.write("%(ok)d in sync, %(changed)d changed, %(error)d errors" % counts)
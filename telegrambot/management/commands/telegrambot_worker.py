@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from telegrambot.ingestion import WorkerPool, claim_queued_updates, process_queued_update
+import time
+
+
+class Command(BaseCommand):
+    help = "Process updates queued by the webhook when TELEGRAM_BOT_INGESTION is 'queue'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help="Worker threads. 0 processes updates in the main thread.")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Updates claimed from the queue table on each poll.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when the queue table is empty.")
+        parser.add_argument('--once', action='store_true', default=False,
+                            help="Drain the queue table and exit.")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        pool = WorkerPool(workers=workers, queue_size=options['batch_size'], target=process_queued_update)
+        pool.start()
+        try:
+            while True:
+                claimed = claim_queued_updates(options['batch_size'])
+                for job in claimed:
+                    if workers:
+                        pool.queue.put(job)
+                    else:
+                        pool.run_job(*job)
+                pool.join()
+                if claimed and options['verbosity'] > 1:
+                    self.stdout.write("%s" % pool.stats())
+                if not claimed:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            pool.stop()
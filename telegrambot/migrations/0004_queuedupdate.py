@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0003_auto_20160202_1803'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueuedUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=100, verbose_name='Token')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('claimed', models.BooleanField(default=False, verbose_name='Claimed')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+            ],
+            options={
+                'verbose_name': 'Queued update',
+                'verbose_name_plural': 'Queued updates',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:54
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0004_queuedupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bot',
+            name='handlers_conf',
+            field=models.CharField(blank=True, help_text='Module with the handlers of this bot. TELEGRAM_BOT_HANDLERS_CONF if empty.', max_length=255, null=True, verbose_name='Handlers conf'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 09:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0006_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('template_text', models.CharField(max_length=255, verbose_name='Text template')),
+                ('template_keyboard', models.CharField(blank=True, max_length=255, verbose_name='Keyboard template')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Date Finished')),
+            ],
+            options={
+                'verbose_name': 'Broadcast',
+                'verbose_name_plural': 'Broadcasts',
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='Chat')),
+                ('status', models.CharField(choices=[('sent', 'Sent'), ('failed', 'Failed'), ('blocked', 'Blocked')], max_length=10, verbose_name='Status')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Date Created')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='telegrambot.Broadcast', verbose_name='Broadcast')),
+            ],
+            options={
+                'verbose_name': 'Broadcast delivery',
+                'verbose_name_plural': 'Broadcast deliveries',
+            },
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='bot',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='broadcasts', to='telegrambot.Bot', verbose_name='Bot'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='broadcastdelivery',
+            unique_together=set([('broadcast', 'chat_id')]),
+        ),
+    ]
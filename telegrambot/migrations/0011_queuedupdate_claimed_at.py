@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 09:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0010_message_chat_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedupdate',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Attempts'),
+        ),
+        migrations.AddField(
+            model_name='queuedupdate',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Claimed at'),
+        ),
+        migrations.RemoveField(
+            model_name='queuedupdate',
+            name='claimed',
+        ),
+        migrations.AlterIndexTogether(
+            name='queuedupdate',
+            index_together=set([('claimed_at', 'attempts')]),
+        ),
+    ]
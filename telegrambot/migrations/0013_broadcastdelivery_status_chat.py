@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 09:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0012_outboxmessage_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='broadcastdelivery',
+            index_together=set([('status', 'chat_id')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 09:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegrambot', '0013_broadcastdelivery_status_chat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='authenticated_only',
+            field=models.BooleanField(default=False, verbose_name='Only authenticated chats'),
+        ),
+    ]
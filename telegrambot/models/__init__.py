@@ -1,3 +1,6 @@
 from telegrambot.models.telegram_api import (User, Chat, Message, Update)  # NOQA
 from telegrambot.models.bot import Bot  # NOQA
-from telegrambot.models.auth import AuthToken  # NOQA
\ No newline at end of file
+from telegrambot.models.auth import AuthToken  # NOQA
+from telegrambot.models.ingestion import QueuedUpdate  # NOQA
+from telegrambot.models.outbox import OutboxMessage  # NOQA
+from telegrambot.models.broadcast import Broadcast, BroadcastDelivery  # NOQA
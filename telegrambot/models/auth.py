@@ -3,6 +3,7 @@ from django.db import models
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
+from django.core.cache import cache
 from telegrambot.models import Chat
 import logging
 import os
@@ -15,6 +16,47 @@ logger = logging.getLogger(__file__)
 
 AUTH_USER_MODEL = getattr(settings, 'AUTH_USER_MODEL', 'auth.User')
 
+
+def expiration_date():
+    return now() - timedelta(hours=int(getattr(settings, 'TELEGRAM_BOT_TOKEN_EXPIRATION', '24')))
+
+
+class AuthTokenQuerySet(models.QuerySet):
+
+    def expired(self):
+        return self.filter(created__lt=expiration_date())
+
+    def delete_expired(self, batch_size=1000, max_batches=None):
+        """
+        Delete expired tokens, oldest first, ``batch_size`` rows per query so the table is not locked
+        for long. Returns the number of tokens deleted.
+        """
+        deleted = batches = 0
+        while max_batches is None or batches < max_batches:
+            keys = list(self.expired().order_by('created').values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                break
+            self.filter(pk__in=keys).delete()
+            deleted += len(keys)
+            batches += 1
+        return deleted
+
+    def delete_expired_periodically(self):
+        """
+        Delete expired tokens at most once every ``TELEGRAM_BOT_TOKEN_CLEANUP_INTERVAL`` seconds
+        across processes. Does nothing unless the setting is defined. Runs inside requests, so only
+        ``TELEGRAM_BOT_TOKEN_CLEANUP_BATCHES`` batches of ``TELEGRAM_BOT_TOKEN_CLEANUP_BATCH_SIZE``
+        tokens are deleted, the rest in later runs or with ``telegrambot_clean_tokens``.
+        """
+        interval = getattr(settings, 'TELEGRAM_BOT_TOKEN_CLEANUP_INTERVAL', None)
+        if not interval or not cache.add('telegrambot:token_cleanup', True, interval):
+            return 0
+        deleted = self.delete_expired(getattr(settings, 'TELEGRAM_BOT_TOKEN_CLEANUP_BATCH_SIZE', 100),
+                                      getattr(settings, 'TELEGRAM_BOT_TOKEN_CLEANUP_BATCHES', 1))
+        if deleted:
+            logger.info("Deleted %d expired authentication tokens" % deleted)
+        return deleted
+
 @python_2_unicode_compatible
 class AuthToken(models.Model):
     key = models.CharField(max_length=40, primary_key=True)
@@ -22,7 +64,9 @@ class AuthToken(models.Model):
                                 on_delete=models.CASCADE)
     chat_api = models.OneToOneField(Chat, related_name='auth_token',
                                     on_delete=models.CASCADE, blank=True, null=True)
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = AuthTokenQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('Authentication Token')
@@ -38,7 +82,7 @@ class AuthToken(models.Model):
     
     def expired(self):
         
-        return self.created < now() - timedelta(hours=int(getattr(settings, 'TELEGRAM_BOT_TOKEN_EXPIRATION', '24')))
+        return self.created < expiration_date()
 
     def __str__(self):
         return self.key
@@ -3,14 +3,19 @@ from django.db import models
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
-from telegram import Bot as BotAPI
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.urlresolvers import reverse
 import logging
 from telegrambot.models import User
-from telegrambot.handlers import HandlerResolver
+from telegrambot.handlers import get_resolver
 from telegrambot.handlers import HandlerNotFound
+from telegrambot.models.outbox import OutboxMessage
+from telegrambot.outbound import get_dispatcher
+from telegrambot.resilience import get_client, is_timeout, is_transient
+from telegrambot.transport import get_api
+from telegrambot import codec
+from telegram import ReplyMarkup
 
 logger = logging.getLogger(__file__)
 
@@ -23,6 +28,9 @@ class Bot(models.Model):
     ssl_certificate = models.FileField(_("SSL certificate"), upload_to='telegrambot/ssl/', 
                                        blank=True, null=True)
     enabled = models.BooleanField(_('Enable'), default=True)
+    handlers_conf = models.CharField(_('Handlers conf'), max_length=255, blank=True, null=True,
+                                     help_text=_("Module with the handlers of this bot. "
+                                                 "TELEGRAM_BOT_HANDLERS_CONF if empty."))
     created = models.DateTimeField(_('Date Created'), auto_now_add=True)
     modified = models.DateTimeField(_('Date Modified'), auto_now=True)    
     
@@ -30,54 +38,150 @@ class Bot(models.Model):
         verbose_name = _('Bot')
         verbose_name_plural = _('Bots')    
     
+    WEBHOOK_FIELDS = ('token', 'enabled', 'ssl_certificate')
+
     def __init__(self, *args, **kwargs):
         super(Bot, self).__init__(*args, **kwargs)
-        self._bot = None
-        if self.token:
-            self._bot = BotAPI(self.token)
+        self._api = (None, None)
+        self._resolver = (None, None)
+        #  Webhook fields last registered, None if unknown
+        self._webhook_state = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Bot, cls).from_db(db, field_names, values)
+        if set(cls.WEBHOOK_FIELDS) <= set(field_names):
+            instance._webhook_state = instance.get_webhook_state()
+        return instance
+
+    @property
+    def _bot(self):
+        """
+        Bot API client, created on first use and shared by the bots with the same token.
+        """
+        token, api = self._api
+        if token != self.token:
+            api = get_api(self.token) if self.token else None
+            self._api = (self.token, api)
+        return api
+
+    @_bot.setter
+    def _bot(self, api):
+        self._api = (self.token, api)
             
     def __str__(self):
         return "%s" % (self.user_api.first_name or self.token if self.user_api else self.token)
             
+    def get_webhook_state(self):
+        return (self.token, self.enabled, self.ssl_certificate.name if self.ssl_certificate else None)
+
+    def webhook_changed(self):
+        """
+        Whether ``token``, ``enabled`` or ``ssl_certificate`` changed since the webhook was registered.
+        """
+        return self._webhook_state != self.get_webhook_state()
+
+    def get_webhook_url(self):
+        """
+        Url the webhook should be set to, ``None`` if the bot is disabled.
+        """
+        if not self.enabled:
+            return None
+        from django.contrib.sites.models import Site
+        webhook = reverse('telegrambot:webhook', kwargs={'token': self.token})
+        return 'https://' + Site.objects.get_current().domain + webhook
+
+    def set_webhook(self, url=None):
+        """
+        Register the webhook of the bot, to ``get_webhook_url()`` unless ``url`` is given.
+        """
+        state = self.get_webhook_state()
+        url = url or self.get_webhook_url()
+        cert = self.ssl_certificate.open() if self.ssl_certificate else None
+        get_client(self.token).call(self._bot.setWebhook, webhook_url=url, certificate=cert)
+        self._webhook_state = state
+        return url
+
+    def get_handlers_conf(self):
+        return self.handlers_conf or settings.TELEGRAM_BOT_HANDLERS_CONF
+    
+    @property
+    def resolver(self):
+        """
+        Resolver of this bot handlers, compiled once per conf.
+        """
+        handlerconf = self.get_handlers_conf()
+        conf, resolver = self._resolver
+        if conf != handlerconf:
+            resolver = get_resolver(handlerconf)
+            self._resolver = (handlerconf, resolver)
+        return resolver
+            
     def handle(self, update):
-        handlerconf = settings.TELEGRAM_BOT_HANDLERS_CONF
-        resolver = HandlerResolver(handlerconf)
         try:
-            resolver_match = resolver.resolve(update)
+            resolver_match = self.resolver.resolve(update)
         except HandlerNotFound:
             logger.warning("Handler not found for %s" % update)
         else:
             callback, callback_args, callback_kwargs = resolver_match
             callback(self, update, **callback_kwargs)
         
-    def send_message(self, chat_id, text, parse_mode=None, disable_web_page_preview=None, **kwargs):
-        self._bot.sendMessage(chat_id=chat_id, text=text, parse_mode=parse_mode, 
-                              disable_web_page_preview=disable_web_page_preview, **kwargs)        
+    def send_message(self, chat_id, text, parse_mode=None, disable_web_page_preview=None, priority=0, **kwargs):
+        """
+        Send a message, or queue it in the outbound dispatcher if ``TELEGRAM_BOT_OUTBOUND`` is set.
+        """
+        kwargs.update(text=text, parse_mode=parse_mode, disable_web_page_preview=disable_web_page_preview)
+        dispatcher = get_dispatcher()
+        if dispatcher is not None:
+            return dispatcher.submit(self, chat_id, kwargs, priority)
+        return self.deliver(chat_id, kwargs)
+    
+    def deliver(self, chat_id, kwargs):
+        """
+        Send a message now, with retries. The message is parked in the outbox if the Bot API is unavailable,
+        and dropped if it timed out since it may have been delivered.
+        """
+        try:
+            return get_client(self.token).call(self._bot.sendMessage, chat_id=chat_id, **kwargs)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            if is_timeout(e):
+                logger.error("Message to chat %s timed out, not sent again to avoid a duplicate" % chat_id)
+                return None
+            self.park_message(chat_id, kwargs, e)
+            
+    def park_message(self, chat_id, kwargs, error=None):
+        payload = dict(kwargs)
+        if isinstance(payload.get('reply_markup'), ReplyMarkup):
+            payload['reply_markup'] = payload['reply_markup'].to_json()
+        logger.warning("Bot API unavailable (%s), message to chat %s parked" % (error, chat_id))
+        return OutboxMessage.objects.create(bot=self, chat_id=chat_id, payload=codec.dumps(payload),
+                                            last_error="%s" % (error or ''))
 
 @receiver(post_save, sender=Bot)
-def set_api(sender, instance, **kwargs):
-    #  set bot api if not yet
-    if not instance._bot:
-        instance._bot = BotAPI(instance.token)
-
-    # set webhook
-    url = None
-    cert = None
-    if instance.enabled:
-        webhook = reverse('telegrambot:webhook', kwargs={'token': instance.token})        
-        from django.contrib.sites.models import Site
-        current_site = Site.objects.get_current()
-        url = 'https://' + current_site.domain + webhook   
-    if instance.ssl_certificate:
-        cert = instance.ssl_certificate.open()
-    instance._bot.setWebhook(webhook_url=url, 
-                             certificate=cert)
-    logger.info("Success: Webhook url %s for bot %s set" % (url, str(instance)))
+def set_api(sender, instance, created=False, **kwargs):
+    #  set webhook only if it may have changed
+    if created or instance.webhook_changed():
+        try:
+            url = instance.set_webhook()
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            logger.error("Error setting webhook url for bot %s: %s" % (str(instance), e))
+        else:
+            logger.info("Success: Webhook url %s for bot %s set" % (url, str(instance)))
     
     #  complete  Bot instance with api data
     if not instance.user_api:
-        bot_api = instance._bot.getMe()
+        try:
+            bot_api = get_client(instance.token).call(instance._bot.getMe)
+        except Exception as e:
+            if not is_transient(e):
+                raise
+            logger.error("Error getting api info for bot %s: %s" % (str(instance), e))
+            return
         user_api, _ = User.objects.get_or_create(**bot_api.to_dict())
         instance.user_api = user_api
-        instance.save()
+        instance.save(update_fields=['user_api'])
         logger.info("Success: Bot api info for bot %s set" % str(instance))
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class Broadcast(models.Model):
+    """
+    Message rendered from ``template_text`` and sent to many chats by ``telegrambot.broadcast``.
+    """
+    bot = models.ForeignKey('telegrambot.Bot', verbose_name=_('Bot'), related_name='broadcasts',
+                            on_delete=models.CASCADE)
+    template_text = models.CharField(_('Text template'), max_length=255)
+    template_keyboard = models.CharField(_('Keyboard template'), max_length=255, blank=True)
+    authenticated_only = models.BooleanField(_('Only authenticated chats'), default=False)
+    created = models.DateTimeField(_('Date Created'), auto_now_add=True)
+    finished = models.DateTimeField(_('Date Finished'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('Broadcast')
+        verbose_name_plural = _('Broadcasts')
+        ordering = ['-id', ]
+
+    def __str__(self):
+        return "%s" % self.template_text
+
+
+@python_2_unicode_compatible
+class BroadcastDelivery(models.Model):
+    """
+    Outcome of a broadcast for one chat. Chats with a delivery sent or blocked are skipped when
+    the broadcast is resumed, chats that blocked the bot are skipped by its next broadcasts.
+    """
+    SENT, FAILED, BLOCKED = 'sent', 'failed', 'blocked'
+
+    STATUS_CHOICES = (
+        (SENT, _('Sent')),
+        (FAILED, _('Failed')),
+        (BLOCKED, _('Blocked')),
+    )
+
+    broadcast = models.ForeignKey(Broadcast, verbose_name=_('Broadcast'), related_name='deliveries',
+                                  on_delete=models.CASCADE)
+    chat_id = models.BigIntegerField(_('Chat'))
+    status = models.CharField(_('Status'), max_length=10, choices=STATUS_CHOICES)
+    error = models.TextField(_('Error'), blank=True)
+    created = models.DateTimeField(_('Date Created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Broadcast delivery')
+        verbose_name_plural = _('Broadcast deliveries')
+        unique_together = ('broadcast', 'chat_id')
+        index_together = [('status', 'chat_id')]
+
+    def __str__(self):
+        return "%s %s" % (self.chat_id, self.status)
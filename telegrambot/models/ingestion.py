@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class QueuedUpdate(models.Model):
+    """
+    Raw update accepted by the webhook and waiting for ``telegrambot_worker`` to process it.
+    Rows are claimed by setting ``claimed_at`` and deleted once processed.
+    """
+    token = models.CharField(_('Token'), max_length=100)
+    payload = models.TextField(_('Payload'))
+    claimed_at = models.DateTimeField(_('Claimed at'), blank=True, null=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    created = models.DateTimeField(_('Date Created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Queued update')
+        verbose_name_plural = _('Queued updates')
+        ordering = ['id', ]
+        index_together = [('claimed_at', 'attempts')]
+
+    def __str__(self):
+        return "%s" % self.pk
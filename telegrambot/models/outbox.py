@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from django.db import models
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class OutboxMessage(models.Model):
+    """
+    Message that could not be sent because the Bot API was unavailable, sent again by
+    ``telegrambot_drain_outbox``.
+    """
+    bot = models.ForeignKey('telegrambot.Bot', verbose_name=_('Bot'), related_name='outbox',
+                            on_delete=models.CASCADE)
+    chat_id = models.BigIntegerField(_('Chat'))
+    payload = models.TextField(_('Payload'))
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last error'), blank=True)
+    claimed_at = models.DateTimeField(_('Claimed at'), blank=True, null=True, db_index=True)
+    created = models.DateTimeField(_('Date Created'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Outbox message')
+        verbose_name_plural = _('Outbox messages')
+        ordering = ['id', ]
+
+    def __str__(self):
+        return "%s" % self.pk
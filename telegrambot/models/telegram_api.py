@@ -46,22 +46,57 @@ class Chat(models.Model):
     def is_authenticated(self):
         return hasattr(self, 'auth_token') and not self.auth_token.expired()
 
+class MessageQuerySet(models.QuerySet):
+
+    def history(self, chat, before=None, limit=20):
+        """
+        The ``limit`` last messages of ``chat``, newest first. ``before``, a message or a
+        ``(date, message_id)`` pair such as the last one of the previous page, or a date, only
+        returns older messages.
+        """
+        queryset = self.filter(chat=chat).order_by('-date', '-message_id')
+        if isinstance(before, Message):
+            before = (before.date, before.message_id)
+        if isinstance(before, tuple):
+            date, message_id = before
+            queryset = queryset.filter(models.Q(date__lt=date) | models.Q(date=date, message_id__lt=message_id))
+        elif before is not None:
+            queryset = queryset.filter(date__lt=before)
+        return queryset[:limit]
+
+    def iter_history(self, chat, before=None, batch_size=100):
+        """
+        Iterate over the whole history of ``chat``, newest first, fetching ``batch_size`` messages
+        per query.
+        """
+        while True:
+            messages = list(self.history(chat, before, batch_size))
+            for message in messages:
+                yield message
+            if len(messages) < batch_size:
+                return
+            before = messages[-1]
+
+
 @python_2_unicode_compatible
 class Message(models.Model):
 
     message_id = models.BigIntegerField(_('Id'), primary_key=True)
     from_user = models.ForeignKey(User, related_name='messages', verbose_name=_("User"))
-    date = models.DateTimeField(_('Date'))
+    date = models.DateTimeField(_('Date'), db_index=True)
     chat = models.ForeignKey(Chat, related_name='messages', verbose_name=_("Chat"))
     forward_from = models.ForeignKey(User, null=True, blank=True, related_name='forwarded_from',
                                      verbose_name=_("Forward from"))
     text = models.TextField(null=True, blank=True, verbose_name=_("Text"))
     #  TODO: complete fields with all message fields
 
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Message'
         verbose_name_plural = 'Messages'
         ordering = ['-date', ]
+        index_together = [('chat', 'date', 'message_id')]
 
     def __str__(self):
         return "(%s,%s)" % (self.from_user, self.text or '(no text)')
@@ -0,0 +1,287 @@
+"""
+Outbound message dispatcher.
+
+With ``TELEGRAM_BOT_OUTBOUND`` set, ``Bot.send_message`` queues messages instead of sending them
+from the handler. Worker threads send them in priority order as fast as Telegram limits allow:
+per bot, per private chat and per group token buckets, and a pause of the whole bot for the
+``retry after`` seconds of a 429 response.
+"""
+from django.conf import settings
+from django.db import close_old_connections
+from telegrambot.resilience import CircuitOpen, retry_after, is_timeout, is_transient, get_breaker
+from telegrambot.utils import LRUCache
+from collections import deque
+import atexit
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    ``rate`` tokens per second, up to ``capacity`` saved for bursts. Not thread safe.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+def is_private(chat_id):
+    """
+    Private chats have positive ids. Groups and channels have negative ones, or are given as
+    ``@channelusername``.
+    """
+    try:
+        return int(chat_id) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+class OutboundMessage(object):
+
+    def __init__(self, bot, chat_id, kwargs, priority=0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.priority = priority
+        self.queued = time.time()
+        self.attempts = 0
+
+    def send(self):
+        return self.bot._bot.sendMessage(chat_id=self.chat_id, **self.kwargs)
+
+    def park(self, error):
+        try:
+            self.bot.park_message(self.chat_id, self.kwargs, error)
+        except Exception:
+            logger.exception("Error parking message to chat %s", self.chat_id)
+
+
+class OutboundDispatcher(object):
+    """
+    Priority queue of outgoing messages sent by ``workers`` threads within Telegram rate limits.
+    Lower ``priority`` values are sent first, in submission order for equal priorities.
+    """
+
+    def __init__(self, workers=4, bot_rate=30, private_rate=1, group_rate=20 / 60.0, group_burst=20,
+                 max_attempts=5, chats=100000):
+        self.workers = workers
+        self.bot_rate = bot_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_attempts = max_attempts
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self._ready = []
+        self._delayed = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._bots = {}
+        self._paused = {}
+        self._chats = LRUCache(chats)
+        self._latencies = deque(maxlen=1000)
+        self._threads = []
+        self._stopped = False
+        self._sending = 0
+
+    def submit(self, bot, chat_id, kwargs, priority=0):
+        message = OutboundMessage(bot, chat_id, kwargs, priority)
+        with self._cond:
+            heapq.heappush(self._ready, (priority, next(self._counter), message))
+            self._cond.notify()
+        return message
+
+    def qsize(self):
+        with self._cond:
+            return len(self._ready) + len(self._delayed)
+
+    def stats(self):
+        """
+        Queue length, counters and send latency (seconds from submission to sent) of the last
+        1000 messages.
+        """
+        latencies = list(self._latencies)
+        return {'queued': self.qsize(), 'sent': self.sent, 'failed': self.failed, 'retried': self.retried,
+                'latency_avg': sum(latencies) / len(latencies) if latencies else 0,
+                'latency_max': max(latencies) if latencies else 0}
+
+    def bot_bucket(self, token):
+        if token not in self._bots:
+            self._bots[token] = TokenBucket(self.bot_rate)
+        return self._bots[token]
+
+    def chat_bucket(self, token, chat_id):
+        key = (token, chat_id)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if is_private(chat_id):
+                bucket = TokenBucket(self.private_rate)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._chats.set(key, bucket)
+        return bucket
+
+    def _delay(self, message, until):
+        heapq.heappush(self._delayed, (until, message.priority, next(self._counter), message))
+
+    def _next(self, now):
+        """
+        Pop the first message that can be sent now, taking its tokens. Returns ``(message, None)``
+        or ``(None, seconds)`` to wait. Called with the lock held.
+        """
+        while self._delayed and self._delayed[0][0] <= now:
+            _, priority, count, message = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (priority, count, message))
+        while self._ready:
+            _, _, message = heapq.heappop(self._ready)
+            token = message.bot.token
+            wait = max(self._paused.get(token, now) - now,
+                       self.bot_bucket(token).wait(now),
+                       self.chat_bucket(token, message.chat_id).wait(now))
+            if wait > 0:
+                self._delay(message, now + wait)
+                continue
+            self.bot_bucket(token).consume(now)
+            self.chat_bucket(token, message.chat_id).consume(now)
+            return message, None
+        if self._delayed:
+            return None, self._delayed[0][0] - now
+        return None, None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped and not self._ready and not self._delayed:
+                        return
+                    message, wait = self._next(time.time())
+                    if message is not None:
+                        self._sending += 1
+                        break
+                    self._cond.wait(wait)
+            try:
+                self.deliver(message)
+            finally:
+                close_old_connections()
+                with self._cond:
+                    self._sending -= 1
+                    self._cond.notify_all()
+
+    def deliver(self, message):
+        """
+        Send ``message``. Rate limited messages are queued again, messages failing while the Bot API
+        is unavailable are parked in the bot outbox, timed out ones are dropped.
+        """
+        breaker = get_breaker(message.bot.token)
+        message.attempts += 1
+        try:
+            if not breaker.allow():
+                raise CircuitOpen("Bot API circuit open for sendMessage")
+            message.send()
+        except Exception as e:
+            seconds = retry_after(e)
+            if seconds is not None and message.attempts < self.max_attempts:
+                breaker.success()
+                logger.warning("Rate limited sending to chat %s, retrying in %ss", message.chat_id, seconds)
+                with self._cond:
+                    until = time.time() + seconds
+                    self._paused[message.bot.token] = max(self._paused.get(message.bot.token, 0), until)
+                    self._delay(message, until)
+                    self.retried += 1
+                return
+            self.failed += 1
+            if is_transient(e):
+                if not isinstance(e, CircuitOpen):
+                    breaker.failure()
+                if is_timeout(e):
+                    #  May have been delivered
+                    logger.error("Message to chat %s timed out, not sent again", message.chat_id)
+                else:
+                    message.park(e)
+            else:
+                breaker.success()
+                logger.error("Error sending message to chat %s: %s", message.chat_id, e)
+        else:
+            breaker.success()
+            self.sent += 1
+            self._latencies.append(time.time() - message.queued)
+
+    def start(self):
+        if not self._threads:
+            self._stopped = False
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name='telegrambot-outbound-%d' % i)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """
+        Stop the workers once every queued message has been sent.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def join(self, timeout=None):
+        """
+        Wait until the queue is empty and no message is being sent.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._ready or self._delayed or self._sending:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Return the process wide dispatcher, or ``None`` if ``TELEGRAM_BOT_OUTBOUND`` is not set.
+    """
+    global _dispatcher
+    options = getattr(settings, 'TELEGRAM_BOT_OUTBOUND', None)
+    if not options:
+        return None
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = OutboundDispatcher(**options)
+            _dispatcher.start()
+            atexit.register(_dispatcher.stop)
+        return _dispatcher
@@ -0,0 +1,52 @@
+"""
+Sending again the messages parked in ``OutboxMessage`` while the Bot API was unavailable.
+"""
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from telegrambot import codec
+from telegrambot.models import OutboxMessage
+from telegrambot.resilience import get_client, is_timeout, is_transient
+from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def claim(message, now):
+    """
+    Claim ``message`` for this drainer, ``False`` if another one claimed it since it was read.
+    """
+    return OutboxMessage.objects.filter(pk=message.pk, claimed_at=message.claimed_at).update(claimed_at=now) == 1
+
+
+def drain_outbox(limit=100):
+    """
+    Send up to ``limit`` parked messages, oldest first. Messages of a bot whose API is still
+    unavailable stay parked, messages refused by Telegram or timing out are dropped. Messages are
+    claimed before being sent, claims older than ``TELEGRAM_BOT_OUTBOX_CLAIM_TIMEOUT`` seconds are
+    taken over. Returns the number sent.
+    """
+    sent = 0
+    unavailable = set()
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'TELEGRAM_BOT_OUTBOX_CLAIM_TIMEOUT', 300))
+    pending = OutboxMessage.objects.filter(Q(claimed_at__isnull=True) | Q(claimed_at__lt=stale))
+    for message in pending.select_related('bot')[:limit]:
+        if message.bot_id in unavailable or not claim(message, now):
+            continue
+        bot = message.bot
+        try:
+            get_client(bot.token, max_wait=None).call(bot._bot.sendMessage, chat_id=message.chat_id,
+                                                      **codec.loads(message.payload))
+        except Exception as e:
+            if is_transient(e) and not is_timeout(e):
+                unavailable.add(message.bot_id)
+                OutboxMessage.objects.filter(pk=message.pk).update(attempts=F('attempts') + 1,
+                                                                   last_error="%s" % e, claimed_at=None)
+                continue
+            logger.error("Dropping parked message %s to chat %s: %s", message.pk, message.chat_id, e)
+        else:
+            sent += 1
+        message.delete()
+    return sent
@@ -0,0 +1,15 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from telegrambot import codec
+
+
+class UpdateJSONParser(JSONParser):
+    """
+    Parses webhook payloads with ``telegrambot.codec``.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return codec.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % exc)
@@ -0,0 +1,370 @@
+"""
+Persistence of incoming updates.
+
+``save_update`` writes the user, chat, message and update of one update inside a single transaction
+using native upserts (``INSERT ... ON CONFLICT``) where the database supports them. Users and chats
+whose fields did not change since they were last written by this process are not written again.
+
+With ``TELEGRAM_BOT_WRITE_BEHIND`` set, updates are instead collected in a ``WriteBehindBuffer`` and
+written in batches by a background thread.
+"""
+from django.conf import settings
+from django.db import connections, router, transaction, close_old_connections
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from telegrambot.models import User, Chat, Message, Update, AuthToken
+from telegrambot.utils import LRUCache
+from telegrambot import auth_cache
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = getattr(settings, 'TELEGRAM_BOT_PERSISTENCE_CACHE_SIZE', 10000)
+
+#  Hash of the fields last written for each user and chat id
+written_users = LRUCache(CACHE_SIZE)
+written_chats = LRUCache(CACHE_SIZE)
+
+_sql_cache = {}
+
+
+def supports_upsert(connection):
+    if connection.vendor == 'postgresql':
+        return connection.pg_version >= 90500
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24, 0)
+    return connection.vendor == 'mysql'
+
+
+def upsert_sql(model, connection, update_fields):
+    """
+    Insert statement for ``model`` that updates ``update_fields`` on primary key conflict,
+    or ignores the row if ``update_fields`` is empty.
+    """
+    key = (model, connection.vendor, update_fields)
+    if key not in _sql_cache:
+        opts = model._meta
+        qn = connection.ops.quote_name
+        sql = 'INSERT %sINTO %s (%s) VALUES (%s)' % (
+            'IGNORE ' if connection.vendor == 'mysql' and not update_fields else '',
+            qn(opts.db_table),
+            ', '.join(qn(field.column) for field in opts.concrete_fields),
+            ', '.join(['%s'] * len(opts.concrete_fields)))
+        columns = [qn(opts.get_field(name).column) for name in update_fields]
+        if connection.vendor == 'mysql':
+            if columns:
+                sql += ' ON DUPLICATE KEY UPDATE %s' % ', '.join('%s = VALUES(%s)' % (c, c) for c in columns)
+        elif columns:
+            sql += ' ON CONFLICT (%s) DO UPDATE SET %s' % (qn(opts.pk.column),
+                                                           ', '.join('%s = EXCLUDED.%s' % (c, c) for c in columns))
+        else:
+            sql += ' ON CONFLICT (%s) DO NOTHING' % qn(opts.pk.column)
+        _sql_cache[key] = sql
+    return _sql_cache[key]
+
+
+def row_values(instance, connection):
+    return [field.get_db_prep_save(getattr(instance, field.attname), connection)
+            for field in instance._meta.concrete_fields]
+
+
+def field_hash(data):
+    return hash(tuple(sorted(data.items())))
+
+
+def upsert(cursor, connection, instance, update_fields=()):
+    cursor.execute(upsert_sql(type(instance), connection, tuple(update_fields)),
+                   row_values(instance, connection))
+
+
+def link_token(key, chat_id):
+    """
+    Associate the chat to the token sent with ``/start <token>``.
+    """
+    previous = AuthToken.objects.filter(key=key).values_list('chat_api_id', flat=True).first()
+    AuthToken.objects.filter(chat_api_id=chat_id).exclude(key=key).update(chat_api=None)
+    AuthToken.objects.filter(key=key).update(chat_api=chat_id)
+    auth_cache.invalidate(chat_id, previous)
+
+
+def start_token(text):
+    splitted_message = (text or '').split(' ')
+    if len(splitted_message) > 1 and splitted_message[0] == '/start':
+        return splitted_message[1]
+    return None
+
+
+def save_update(validated_data):
+    """
+    Persist an update given in the structure produced by ``UpdateSerializer`` validation.
+    """
+    message_data = validated_data['message']
+    user_data = message_data['from_user']
+    chat_data = message_data['chat']
+    user_hash, chat_hash = field_hash(user_data), field_hash(chat_data)
+    write_user = written_users.get(user_data['id']) != user_hash
+    write_chat = written_chats.get(chat_data['id']) != chat_hash
+    token = start_token(message_data.get('text'))
+
+    using = router.db_for_write(Update)
+    connection = connections[using]
+    message = Message(message_id=message_data['message_id'], from_user_id=user_data['id'],
+                      date=message_data['date'], chat_id=chat_data['id'], text=message_data.get('text'))
+    update = Update(update_id=validated_data['update_id'], message=message)
+    with transaction.atomic(using=using):
+        if supports_upsert(connection):
+            with connection.cursor() as cursor:
+                if write_user:
+                    upsert(cursor, connection, User(**user_data), [f for f in user_data if f != 'id'])
+                if write_chat:
+                    upsert(cursor, connection, Chat(**chat_data), [f for f in chat_data if f != 'id'])
+                if token:
+                    link_token(token, chat_data['id'])
+                upsert(cursor, connection, message)
+                upsert(cursor, connection, update)
+        else:
+            if write_user:
+                User.objects.update_or_create(id=user_data['id'], defaults=user_data)
+            if write_chat:
+                Chat.objects.update_or_create(id=chat_data['id'], defaults=chat_data)
+            if token:
+                link_token(token, chat_data['id'])
+            Message.objects.get_or_create(message_id=message.message_id, defaults={
+                'from_user_id': message.from_user_id, 'date': message.date,
+                'chat_id': message.chat_id, 'text': message.text})
+            Update.objects.get_or_create(update_id=update.update_id, defaults={'message_id': message.message_id})
+
+    def remember():
+        written_users.set(user_data['id'], user_hash)
+        written_chats.set(chat_data['id'], chat_hash)
+    if connection.in_atomic_block and hasattr(transaction, 'on_commit'):
+        transaction.on_commit(remember, using=using)
+    else:
+        remember()
+    return update
+
+
+def bulk_save(users, chats, messages, updates):
+    """
+    Write many rows in one transaction. ``users`` and ``chats`` map ids to field data, existing
+    messages and updates are left untouched.
+    """
+    using = router.db_for_write(Update)
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        if supports_upsert(connection):
+            with connection.cursor() as cursor:
+                for model, rows in ((User, users), (Chat, chats)):
+                    if rows:
+                        update_fields = tuple(f.name for f in model._meta.concrete_fields if not f.primary_key)
+                        cursor.executemany(upsert_sql(model, connection, update_fields),
+                                           [row_values(model(**data), connection) for data in rows.values()])
+                for model, instances in ((Message, messages), (Update, updates)):
+                    if instances:
+                        cursor.executemany(upsert_sql(model, connection, ()),
+                                           [row_values(instance, connection) for instance in instances])
+        else:
+            for model, rows in ((User, users), (Chat, chats)):
+                existing = set(model._default_manager.filter(pk__in=list(rows)).values_list('pk', flat=True))
+                for pk in existing:
+                    #  Only changed users and chats are buffered
+                    model._default_manager.filter(pk=pk).update(**dict(
+                        (name, value) for name, value in rows[pk].items() if name != 'id'))
+                model._default_manager.bulk_create([model(**data) for pk, data in rows.items() if pk not in existing])
+            for model, instances in ((Message, messages), (Update, updates)):
+                instances = list(dict((i.pk, i) for i in instances).values())
+                existing = set(model._default_manager.filter(pk__in=[i.pk for i in instances])
+                               .values_list('pk', flat=True))
+                model._default_manager.bulk_create([i for i in instances if i.pk not in existing])
+
+    def remember():
+        for data in users.values():
+            written_users.set(data['id'], field_hash(data))
+        for data in chats.values():
+            written_chats.set(data['id'], field_hash(data))
+    if connection.in_atomic_block and hasattr(transaction, 'on_commit'):
+        transaction.on_commit(remember, using=using)
+    else:
+        remember()
+
+
+class WriteBehindBuffer(object):
+    """
+    Collects updates in memory and writes them with ``bulk_save`` from a background thread once
+    ``max_size`` rows are pending or ``max_delay`` seconds have passed. If a batch fails its updates
+    are written one by one, those failing again are kept for the next flush up to ``max_attempts``
+    times.
+    """
+
+    def __init__(self, max_size=500, max_delay=1.0, max_attempts=5):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.flushed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._reset()
+
+    def _reset(self):
+        self._users, self._chats, self._messages, self._updates = {}, {}, [], []
+
+    def pending(self):
+        """
+        Number of rows waiting to be written.
+        """
+        return len(self._users) + len(self._chats) + len(self._messages) + len(self._updates)
+
+    def add(self, validated_data):
+        message_data = validated_data['message']
+        if start_token(message_data.get('text')):
+            #  Token association needs the chat row now
+            return save_update(validated_data)
+        user_data, chat_data = message_data['from_user'], message_data['chat']
+        message = Message(message_id=message_data['message_id'], from_user_id=user_data['id'],
+                          date=message_data['date'], chat_id=chat_data['id'], text=message_data.get('text'))
+        update = Update(update_id=validated_data['update_id'], message=message)
+        with self._lock:
+            if written_users.get(user_data['id']) != field_hash(user_data):
+                self._users[user_data['id']] = user_data
+            if written_chats.get(chat_data['id']) != field_hash(chat_data):
+                self._chats[chat_data['id']] = chat_data
+            self._messages.append(message)
+            self._updates.append(update)
+            full = self.pending() >= self.max_size
+        if full:
+            self._wakeup.set()
+        return update
+
+    def flush(self):
+        """
+        Write every pending row. Returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                users, chats, messages, updates = self._users, self._chats, self._messages, self._updates
+                self._reset()
+            count = len(users) + len(chats) + len(messages) + len(updates)
+            if not count:
+                return 0
+            try:
+                bulk_save(users, chats, messages, updates)
+            except Exception:
+                logger.exception("Error writing %d buffered rows, writing them one update at a time" % count)
+                return self.save_each(users, chats, messages, updates)
+            self.flushed += count
+            return count
+
+    def save_each(self, users, chats, messages, updates):
+        """
+        Write each update with its user and chat in its own transaction. Returns the number of rows written.
+        """
+        written = 0
+        for message, update in zip(messages, updates):
+            rows = (dict((pk, users[pk]) for pk in [message.from_user_id] if pk in users),
+                    dict((pk, chats[pk]) for pk in [message.chat_id] if pk in chats),
+                    [message], [update])
+            count = len(rows[0]) + len(rows[1]) + 2
+            try:
+                bulk_save(*rows)
+            except Exception:
+                update.attempts = getattr(update, 'attempts', 0) + 1
+                if update.attempts < self.max_attempts:
+                    self.requeue(*rows)
+                else:
+                    self.failed += count
+                    logger.exception("Update %s dropped after %d attempts" % (update.update_id, update.attempts))
+            else:
+                written += count
+                users.pop(message.from_user_id, None)
+                chats.pop(message.chat_id, None)
+        self.flushed += written
+        return written
+
+    def requeue(self, users, chats, messages, updates):
+        with self._lock:
+            for pk, data in users.items():
+                #  Keep data buffered since, it is newer
+                self._users.setdefault(pk, data)
+            for pk, data in chats.items():
+                self._chats.setdefault(pk, data)
+            self._messages.extend(messages)
+            self._updates.extend(updates)
+
+    def start(self):
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='telegrambot-write-behind')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flusher thread and write what is left.
+        """
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self.flush():
+            pass
+        if self.pending():
+            logger.error("%d buffered rows could not be written" % self.pending())
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.max_delay)
+            self._wakeup.clear()
+            self.flush()
+            close_old_connections()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """
+    Return the process wide write-behind buffer, or ``None`` if ``TELEGRAM_BOT_WRITE_BEHIND`` is not set.
+    """
+    global _buffer
+    options = getattr(settings, 'TELEGRAM_BOT_WRITE_BEHIND', None)
+    if not options:
+        return None
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBehindBuffer(**options)
+            _buffer.start()
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def store_update(validated_data):
+    """
+    Persist an update now, or hand it to the write-behind buffer when it is enabled.
+    """
+    buffer = get_buffer()
+    if buffer is None:
+        return save_update(validated_data)
+    return buffer.add(validated_data)
+
+
+def clear_caches():
+    written_users.clear()
+    written_chats.clear()
+
+
+@receiver(post_delete, sender=User)
+def forget_user(sender, instance, **kwargs):
+    written_users.delete(instance.pk)
+
+
+@receiver(post_delete, sender=Chat)
+def forget_chat(sender, instance, **kwargs):
+    written_chats.delete(instance.pk)
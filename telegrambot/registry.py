@@ -0,0 +1,81 @@
+"""
+Process wide registry of enabled bots keyed by token.
+
+Webhook requests look bots up here instead of querying the database, so the same ``Bot`` instance
+and its Telegram API client are reused across updates. Entries are dropped when a bot is saved or
+deleted in this process and loaded again on next use.
+"""
+from django.db import DatabaseError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from telegrambot.models import Bot
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BotRegistry(object):
+
+    def __init__(self):
+        self._bots = {}
+        self._lock = threading.Lock()
+
+    def get_queryset(self):
+        return Bot.objects.filter(enabled=True).select_related('user_api')
+
+    def load(self):
+        """
+        Warm the registry with every enabled bot.
+        """
+        bots = dict((bot.token, bot) for bot in self.get_queryset())
+        with self._lock:
+            self._bots = bots
+        return len(bots)
+
+    def get(self, token):
+        """
+        Return the enabled bot for ``token``. Raises ``Bot.DoesNotExist`` if there is none.
+        """
+        try:
+            return self._bots[token]
+        except KeyError:
+            bot = self.get_queryset().get(token=token)
+            with self._lock:
+                self._bots[token] = bot
+            return bot
+
+    def invalidate(self, bot):
+        with self._lock:
+            for token, registered in list(self._bots.items()):
+                if token == bot.token or registered.pk == bot.pk:
+                    del self._bots[token]
+
+    def clear(self):
+        with self._lock:
+            self._bots = {}
+
+    def __len__(self):
+        return len(self._bots)
+
+    def __contains__(self, token):
+        return token in self._bots
+
+
+registry = BotRegistry()
+
+
+def warm_registry():
+    try:
+        count = registry.load()
+    except DatabaseError:
+        # Tables not created yet (e.g. before first migrate). Bots are loaded on demand.
+        logger.warning("Bot registry not warmed, bots will be loaded on demand")
+    else:
+        logger.info("Bot registry warmed with %d bots" % count)
+
+
+@receiver(post_save, sender=Bot)
+@receiver(post_delete, sender=Bot)
+def invalidate_bot(sender, instance, **kwargs):
+    registry.invalidate(instance)
@@ -0,0 +1,201 @@
+"""
+Resilient calls to the Telegram Bot API.
+
+``ResilientClient.call`` retries transient errors (network errors, timeouts, 5xx and 429) with
+jittered exponential backoff and waits the ``retry after`` seconds of 429 responses, sleeping at
+most ``max_wait`` seconds per call. Timeouts are only retried for idempotent methods: a timed out
+``sendMessage`` may have been delivered. A circuit
+breaker per bot fails fast with ``CircuitOpen`` once too many calls failed in a row, until
+``reset_timeout`` seconds have passed. Options are read from ``TELEGRAM_BOT_RESILIENCE``.
+"""
+from django.conf import settings
+from telegram.error import TelegramError
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_RE = re.compile(r'retry after (\d+)', re.IGNORECASE)
+
+TRANSIENT_MESSAGES = ('Timed out', 'Bad Gateway', 'Unknown HTTPError 5', 'Internal Server Error',
+                      'Service Unavailable', 'Gateway Timeout', 'Invalid server response')
+
+IDEMPOTENT_METHODS = ('getMe', 'setWebhook', 'getWebhookInfo', 'get_webhook_info', 'getUpdates', 'getFile',
+                      'getUserProfilePhotos')
+
+DEFAULTS = {'retries': 3, 'backoff': 0.5, 'max_backoff': 10, 'max_retry_after': 5, 'max_wait': 2,
+            'failure_threshold': 5, 'reset_timeout': 30}
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'TELEGRAM_BOT_RESILIENCE', {}))
+    return options
+
+
+class CircuitOpen(TelegramError):
+    pass
+
+
+def retry_after(error):
+    """
+    Seconds to wait from a Telegram 429 error, or ``None`` if ``error`` is not one.
+    """
+    match = RETRY_AFTER_RE.search(getattr(error, 'message', None) or str(error))
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def is_timeout(error):
+    """
+    Whether ``error`` is a timeout, or a network error once the request was sent, after which the
+    request may or may not have been processed.
+    """
+    if getattr(error, 'request_sent', False):
+        return True
+    return isinstance(error, TelegramError) and (error.message or '').startswith('Timed out')
+
+
+def is_transient(error):
+    """
+    Whether ``error`` may not happen again if the call is retried.
+    """
+    if isinstance(error, CircuitOpen):
+        return True
+    if isinstance(error, TelegramError):
+        message = error.message or ''
+        return retry_after(error) is not None or message.startswith(TRANSIENT_MESSAGES)
+    return isinstance(error, (IOError, OSError))
+
+
+class CircuitBreaker(object):
+    """
+    Opens after ``failure_threshold`` consecutive failures. Once open, calls are refused until
+    ``reset_timeout`` seconds have passed, then one trial call is let through: its success closes
+    the circuit, its failure opens it again.
+    """
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.time() - self.opened >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == self.HALF_OPEN:
+                #  Let one trial call through, refuse the others until it finishes
+                self.opened = time.time()
+                return True
+            return state == self.CLOSED
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened is not None or self.failures >= self.failure_threshold:
+                self.opened = time.time()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(token):
+    with _breakers_lock:
+        if token not in _breakers:
+            options = get_options()
+            _breakers[token] = CircuitBreaker(options['failure_threshold'], options['reset_timeout'])
+        return _breakers[token]
+
+
+def reset_breakers():
+    with _breakers_lock:
+        _breakers.clear()
+
+
+class ResilientClient(object):
+
+    def __init__(self, token, retries=3, backoff=0.5, max_backoff=10, max_retry_after=5, max_wait=2,
+                 breaker=None):
+        self.token = token
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.max_wait = max_wait
+        self.breaker = breaker or get_breaker(token)
+
+    def delay(self, attempt, error, name=None):
+        """
+        Seconds to wait before retry number ``attempt``, or ``None`` not to retry.
+        """
+        if attempt >= self.retries or (is_timeout(error) and name not in IDEMPOTENT_METHODS):
+            return None
+        seconds = retry_after(error)
+        if seconds is not None:
+            return seconds if seconds <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call the Bot API ``method``. Raises ``CircuitOpen`` without calling it if the circuit is open.
+        """
+        name = getattr(method, '__name__', method)
+        attempt = 0
+        waited = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpen("Bot API circuit open for %s" % name)
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    self.breaker.success()
+                    raise
+                if retry_after(e) is None:
+                    self.breaker.failure()
+                else:
+                    #  Rate limited, the API is up
+                    self.breaker.success()
+                delay = self.delay(attempt, e, name)
+                if delay is None or (self.max_wait is not None and waited + delay > self.max_wait):
+                    raise
+                waited += delay
+                attempt += 1
+                logger.warning("Bot API %s failed (%s), retry %d in %.2fs", name, e, attempt, delay)
+                time.sleep(delay)
+            else:
+                self.breaker.success()
+                return result
+
+
+def get_client(token, **overrides):
+    """
+    Client with the ``TELEGRAM_BOT_RESILIENCE`` options, ``overrides`` replacing some of them such as
+    ``max_wait=None`` outside of webhook requests.
+    """
+    options = get_options()
+    options.update(overrides)
+    return ResilientClient(token, retries=options['retries'], backoff=options['backoff'],
+                           max_backoff=options['max_backoff'], max_retry_after=options['max_retry_after'],
+                           max_wait=options['max_wait'])
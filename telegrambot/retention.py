@@ -0,0 +1,111 @@
+"""
+Retention of the stored messages and updates.
+
+``prune`` deletes the messages older than ``max_age`` days and those beyond the ``max_rows``
+newest ones, with their updates, in batches of primary keys each deleted in its own transaction.
+Each batch can first be written to a gzipped JSON lines archive. Default policies are read from
+``TELEGRAM_BOT_RETENTION``::
+
+    TELEGRAM_BOT_RETENTION = {'max_age': 90, 'max_rows': 1000000, 'archive_dir': '/var/archive'}
+
+Messages are not related to a bot, so policies apply to the messages of every bot.
+"""
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from telegrambot.models import Message, Update
+from datetime import timedelta
+import gzip
+import io
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {'max_age': None, 'max_rows': None, 'batch_size': 1000, 'archive_dir': None}
+
+
+def get_options():
+    options = dict(DEFAULTS)
+    options.update(getattr(settings, 'TELEGRAM_BOT_RETENTION', {}))
+    return options
+
+
+def expired_messages(max_age=None, max_rows=None):
+    """
+    Messages out of the retention policies, ``None`` if there are no policies.
+    """
+    conditions = []
+    if max_age is not None:
+        conditions.append(Q(date__lt=timezone.now() - timedelta(days=max_age)))
+    if max_rows is not None:
+        oldest_kept = Message.objects.order_by('-date', '-pk').values_list('date', 'pk')[max_rows:max_rows + 1]
+        for date, pk in oldest_kept:
+            conditions.append(Q(date__lt=date) | Q(date=date, pk__lte=pk))
+    if not conditions:
+        return None
+    query = conditions[0]
+    for condition in conditions[1:]:
+        query |= condition
+    return Message.objects.filter(query)
+
+
+class Archive(object):
+    """
+    Gzipped JSON lines file with one ``{"model": ..., "fields": ...}`` object per row.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        #  Never truncate an existing archive, its rows are already deleted
+        self.raw = io.open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL), 'wb')
+        self.file = gzip.GzipFile(os.path.basename(path), 'wb', fileobj=self.raw)
+
+    def write(self, model, rows):
+        for row in rows:
+            line = json.dumps({'model': model, 'fields': row}, cls=DjangoJSONEncoder)
+            self.file.write((line + '\n').encode('utf-8'))
+        #  Rows are deleted after each batch, keep them on disk first
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+        self.raw.close()
+
+
+def archive_path(archive_dir):
+    """
+    Path of a new archive, unique for runs started in the same second.
+    """
+    name = 'telegrambot-%s-%d.jsonl.gz' % (timezone.now().strftime('%Y%m%d%H%M%S%f'), os.getpid())
+    return os.path.join(archive_dir, name)
+
+
+def prune(max_age=None, max_rows=None, batch_size=1000, max_batches=None, archive=None):
+    """
+    Delete the messages out of the policies, oldest first, and their updates, writing them to the
+    ``Archive`` ``archive`` if given. Returns the number of messages and updates deleted.
+    """
+    stats = {'messages': 0, 'updates': 0}
+    queryset = expired_messages(max_age, max_rows)
+    if queryset is None:
+        return stats
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        pks = list(queryset.order_by('date', 'pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        if archive is not None:
+            archive.write('message', Message.objects.filter(pk__in=pks).order_by('date', 'pk').values().iterator())
+            archive.write('update', Update.objects.filter(message_id__in=pks).order_by('pk').values().iterator())
+        with transaction.atomic():
+            deleted, _ = Update.objects.filter(message_id__in=pks).delete()
+            stats['updates'] += deleted
+            Message.objects.filter(pk__in=pks).delete()
+            stats['messages'] += len(pks)
+        batches += 1
+    logger.info("Pruned %(messages)d messages and %(updates)d updates" % stats)
+    return stats
@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from telegrambot.models import User, Chat, Message, Update, AuthToken
+from telegrambot.models import User, Chat, Message, Update
+from telegrambot import codec, persistence
+from django.utils import six
 from datetime import datetime
+import telegram
 import time
 
 class UserSerializer(serializers.HyperlinkedModelSerializer):
@@ -51,27 +54,92 @@ class UpdateSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('update_id', 'message')
         
     def create(self, validated_data):
-        user, _ = User.objects.get_or_create(**validated_data['message']['from_user'])
-        
-        chat, created = Chat.objects.get_or_create(**validated_data['message']['chat'])        
-
-        # Associate chat to token if comes /start with token
-        splitted_message = validated_data['message']['text'].split(' ')
-        if len(splitted_message) > 1 and splitted_message[0] == '/start':
-            try:
-                token = AuthToken.objects.get(key=splitted_message[1])
-                token.chat_api = chat
-                token.save()
-            except AuthToken.DoesNotExist:
-                #  Do not associate with any token
-                pass                
-        
-        message, _ = Message.objects.get_or_create(message_id=validated_data['message']['message_id'],
-                                                   from_user=user,
-                                                   date=validated_data['message']['date'],
-                                                   chat=chat,
-                                                   text=validated_data['message']['text'])
-        update, _ = Update.objects.get_or_create(update_id=validated_data['update_id'],
-                                                 message=message)
-
-        return update
\ No newline at end of file
+        return persistence.store_update(validated_data)
+    
+    @classmethod
+    def save_update(cls, update):
+        """
+        Persist an already decoded ``telegram.Update`` without running field validation again.
+        """
+        return cls().create(update_data(update))
+
+
+class UpdateDecodeError(serializers.ValidationError, ValueError):
+    
+    def __init__(self, errors):
+        super(UpdateDecodeError, self).__init__(errors)
+        self.errors = errors
+
+
+REQUIRED = 'This field is required.'
+INVALID = 'Invalid data. Expected a dictionary.'
+INTEGER = 'A valid integer is required.'
+
+#  Persisted fields: name and ``int``, ``None`` for any value, or the fields of a nested object
+UPDATE_FIELDS = (('update_id', int),
+                 ('message', (('message_id', int), ('date', int),
+                              ('from', (('id', int), ('first_name', None))),
+                              ('chat', (('id', int), ('type', None))))))
+
+
+def field_errors(data, fields):
+    errors = {}
+    for name, kind in fields:
+        value = data.get(name)
+        if value is None:
+            errors[name] = [REQUIRED]
+        elif kind is int and (not isinstance(value, six.integer_types) or isinstance(value, bool)):
+            errors[name] = [INTEGER]
+        elif isinstance(kind, tuple):
+            if not isinstance(value, dict):
+                errors[name] = [INVALID]
+            else:
+                nested = field_errors(value, kind)
+                if nested:
+                    errors[name] = nested
+    return errors
+
+
+def decode_update(data):
+    """
+    Decode a webhook payload, a JSON document or an already parsed ``dict``, into a ``telegram.Update``.
+    Checks the fields that are persisted and raises ``UpdateDecodeError``, a ``ValidationError``, if any
+    is missing or malformed.
+    """
+    if isinstance(data, (bytes, six.text_type)):
+        try:
+            data = codec.loads(data)
+        except ValueError:
+            raise UpdateDecodeError({'non_field_errors': ['Invalid JSON.']})
+    if not isinstance(data, dict):
+        raise UpdateDecodeError({'non_field_errors': ['Invalid data.']})
+    errors = field_errors(data, UPDATE_FIELDS)
+    if errors:
+        raise UpdateDecodeError(errors)
+    try:
+        return telegram.Update.de_json(data)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise UpdateDecodeError({'non_field_errors': ['Invalid data: %s' % e]})
+
+
+def update_data(update):
+    """
+    Map a ``telegram.Update`` to the structure ``UpdateSerializer`` produces as validated data.
+    """
+    message = update.message
+    from_user = message.from_user
+    chat = message.chat
+    return {'update_id': update.update_id,
+            'message': {'message_id': message.message_id,
+                        'from_user': {'id': from_user.id,
+                                      'first_name': from_user.first_name,
+                                      'last_name': from_user.last_name or None,
+                                      'username': from_user.username or None},
+                        'date': message.date,
+                        'chat': {'id': chat.id,
+                                 'type': chat.type,
+                                 'title': chat.title or None,
+                                 'username': chat.username or None,
+                                 'first_name': chat.first_name or None,
+                                 'last_name': chat.last_name or None},
+                        'text': message.text or None}}
@@ -1,5 +1,6 @@
 from django import template
 from django.http import QueryDict
+from telegrambot.bot_views.generic.keyboards import command_rows
 register = template.Library()
 
 @register.filter(name='keyboard_field')
@@ -11,10 +12,4 @@ def keyboard_field(value, args=None):
     per_line = qs.get('per_line', 1)
     field = qs.get("field", "slug")
     command = qs.get("command")
-    convert = lambda element: "/" + command + " " + str(getattr(element, field))
-    group = lambda flat, size: [flat[i:i+size] for i in range(0, len(flat), size)]
-    grouped = group(value, int(per_line))
-    new_list = []
-    for line in grouped:
-        new_list.append([convert(e) for e in line])     
-    return str(new_list).encode('utf-8')
\ No newline at end of file
+    return str(command_rows(value, command, field, per_line)).encode('utf-8')
\ No newline at end of file
@@ -0,0 +1,284 @@
+"""
+Pooled keep-alive HTTP transport for the Bot API.
+
+``python-telegram-bot`` opens a new connection, and a new TLS handshake, for every request. With
+``TELEGRAM_BOT_TRANSPORT`` set bots use ``PooledBotAPI`` instead, which sends ``sendMessage``,
+``getMe`` and ``setWebhook`` over keep-alive connections kept in a pool per bot token::
+
+    TELEGRAM_BOT_TRANSPORT = {'pool_size': 4, 'timeout': 10}
+
+``base_url`` points the bots to another Bot API server.
+"""
+from django.conf import settings
+from django.utils.six.moves import http_client, queue
+from django.utils.six.moves.urllib.parse import urlsplit
+from telegram import Bot as BotAPI, Message, ReplyMarkup, User
+from telegram.error import TelegramError
+from telegram.utils import request
+from telegrambot import codec
+from telegrambot.utils import LRUCache
+import socket
+import threading
+
+DEFAULTS = {'pool_size': 4, 'timeout': 10, 'base_url': None}
+
+
+class TransportError(IOError):
+    """
+    Network error. ``request_sent`` is true if it happened after the whole request was sent.
+    """
+
+    def __init__(self, message, request_sent=False):
+        super(TransportError, self).__init__(message)
+        self.request_sent = request_sent
+
+
+def closed_without_response(error):
+    """
+    Whether the ``BadStatusLine`` ``error`` means the connection was closed before any byte of the
+    response was read.
+    """
+    remote_disconnected = getattr(http_client, 'RemoteDisconnected', None)
+    if remote_disconnected is not None and isinstance(error, remote_disconnected):
+        return True
+    return error.line in ('', "''")
+
+
+class HTTPConnection(http_client.HTTPConnection):
+
+    def connect(self):
+        http_client.HTTPConnection.connect(self)
+        #  Headers and body are written separately, do not wait for the ACK of the headers
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class HTTPSConnection(http_client.HTTPSConnection):
+
+    def connect(self):
+        http_client.HTTPSConnection.connect(self)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to ``size`` idle keep-alive connections to one host. Connections are only used by
+    one thread at a time.
+    """
+
+    def __init__(self, scheme, host, port=None, size=4, timeout=10):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.size = size
+        self.timeout = timeout
+        self.created = 0
+        self._idle = queue.LifoQueue(size)
+
+    def new_connection(self):
+        self.created += 1
+        if self.scheme == 'https':
+            return HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get_connection(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self.new_connection(), False
+
+    def put_connection(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """
+        Return ``(status, body)`` of the response. A request on a reused connection that the server
+        had closed meanwhile, failing while sending or closed before any response, is sent again on a
+        new one. Other failures are raised, the server may have processed the request.
+        """
+        while True:
+            connection, reused = self.get_connection()
+            sent = False
+            try:
+                try:
+                    connection.request(method, path, body, headers or {})
+                    sent = True
+                except socket.timeout:
+                    raise
+                except (socket.error, http_client.HTTPException):
+                    if reused:
+                        connection.close()
+                        continue
+                    raise
+                try:
+                    response = connection.getresponse()
+                except http_client.BadStatusLine as e:
+                    if reused and closed_without_response(e):
+                        connection.close()
+                        continue
+                    raise
+                data = response.read()
+            except socket.timeout:
+                connection.close()
+                raise TelegramError("Timed out")
+            except (socket.error, http_client.HTTPException) as e:
+                connection.close()
+                raise TransportError("%s" % e, request_sent=sent)
+            if response.will_close:
+                connection.close()
+            else:
+                self.put_connection(connection)
+            return response.status, data
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class PooledTransport(object):
+    """
+    Bot API requests over a ``ConnectionPool`` per host, raising ``TelegramError`` as
+    ``telegram.utils.request`` does.
+    """
+
+    def __init__(self, pool_size=4, timeout=10):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self._lock:
+            if key not in self._pools:
+                host, _, port = netloc.partition(':')
+                self._pools[key] = ConnectionPool(scheme, host, int(port) if port else None,
+                                                  self.pool_size, self.timeout)
+            return self._pools[key]
+
+    def post(self, url, data):
+        parts = urlsplit(url)
+        pool = self.get_pool(parts.scheme, parts.netloc)
+        status, body = pool.request('POST', parts.path, codec.dumps(data).encode('utf-8'),
+                                    {'Content-Type': 'application/json'})
+        if status == 403:
+            raise TelegramError('Unauthorized')
+        if status == 502:
+            raise TelegramError('Bad Gateway')
+        try:
+            result = codec.loads(body)
+        except ValueError:
+            if status != 200:
+                raise TelegramError('Unknown HTTPError {0}'.format(status))
+            raise TelegramError('Invalid server response')
+        if not result.get('ok'):
+            raise TelegramError(result.get('description') or 'Unknown HTTPError {0}'.format(status))
+        return result['result']
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close()
+            self._pools = {}
+
+
+class PooledBotAPI(BotAPI):
+    """
+    ``telegram.Bot`` sending ``sendMessage``, ``getMe`` and ``setWebhook`` through a pooled transport.
+    Other methods, and ``setWebhook`` with a certificate, use the library requests.
+    """
+
+    def __init__(self, token, base_url=None, transport=None):
+        super(PooledBotAPI, self).__init__(token, base_url)
+        self.transport = transport or get_transport(token)
+
+    def getMe(self):
+        self.bot = User.de_json(self.transport.post('%s/getMe' % self.base_url, {}))
+        return self.bot
+
+    def sendMessage(self, chat_id, text, parse_mode=None, disable_web_page_preview=None, **kwargs):
+        if not chat_id:
+            raise TelegramError('Invalid chat_id')
+        data = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            data['parse_mode'] = parse_mode
+        if disable_web_page_preview:
+            data['disable_web_page_preview'] = disable_web_page_preview
+        if kwargs.get('reply_to_message_id'):
+            data['reply_to_message_id'] = kwargs['reply_to_message_id']
+        reply_markup = kwargs.get('reply_markup')
+        if reply_markup:
+            data['reply_markup'] = reply_markup.to_json() if isinstance(reply_markup, ReplyMarkup) else reply_markup
+        result = self.transport.post('%s/sendMessage' % self.base_url, data)
+        if result is True:
+            return result
+        return Message.de_json(result)
+
+    def setWebhook(self, webhook_url=None, certificate=None):
+        if certificate:
+            return super(PooledBotAPI, self).setWebhook(webhook_url, certificate)
+        data = {}
+        if webhook_url:
+            data['url'] = webhook_url
+        return self.transport.post('%s/setWebhook' % self.base_url, data)
+
+
+def get_options():
+    options = getattr(settings, 'TELEGRAM_BOT_TRANSPORT', None)
+    if not options:
+        return None
+    return dict(DEFAULTS, **options)
+
+
+_transports = {}
+_transports_lock = threading.Lock()
+
+
+def get_transport(token):
+    """
+    Process wide transport of the bot with ``token``.
+    """
+    options = get_options() or DEFAULTS
+    with _transports_lock:
+        if token not in _transports:
+            _transports[token] = PooledTransport(options['pool_size'], options['timeout'])
+        return _transports[token]
+
+
+def close_transports():
+    with _transports_lock:
+        for transport in _transports.values():
+            transport.close()
+        _transports.clear()
+    _apis.clear()
+
+
+_apis = LRUCache(getattr(settings, 'TELEGRAM_BOT_API_CACHE_SIZE', 128))
+
+
+def get_api(token):
+    """
+    Process wide Bot API client for ``token``: pooled if ``TELEGRAM_BOT_TRANSPORT`` is set.
+    """
+    options = get_options()
+    key = (token, tuple(sorted(options.items())) if options else None)
+    api = _apis.get(key)
+    if api is None:
+        api = BotAPI(token) if options is None else PooledBotAPI(token, options['base_url'])
+        _apis.set(key, api)
+    return api
+
+
+def get_webhook_info(api):
+    """
+    Result of ``getWebhookInfo``, which ``telegram.Bot`` does not implement, for the client ``api``.
+    """
+    url = '%s/getWebhookInfo' % api.base_url
+    if isinstance(api, PooledBotAPI):
+        return api.transport.post(url, {})
+    return request.get(url)
@@ -1,9 +1,12 @@
 from rest_framework.views import APIView
-from telegrambot.serializers import UpdateSerializer
+from telegrambot.serializers import UpdateSerializer, UpdateDecodeError, decode_update
+from telegrambot.parsers import UpdateJSONParser
 from telegrambot.models import Bot, AuthToken
 from rest_framework.response import Response
 from rest_framework import status
-from telegram import Update
+from telegrambot import ingestion
+from telegrambot.registry import registry
+from telegrambot.deduplication import get_deduplicator
 import logging
 from django.views import generic
 import sys
@@ -12,26 +15,63 @@ import traceback
 logger = logging.getLogger(__name__)
 
 class WebhookView(APIView):
+    parser_classes = (UpdateJSONParser, )
     
     def post(self, request, token):
-        serializer = UpdateSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save()
-            try:
-                bot = Bot.objects.get(token=token)
-                bot.handle(Update.de_json(request.data))
-            except Bot.DoesNotExist:
-                logger.warning("Token %s not associated to a bot" % token)
-                return Response(serializer.errors, status=status.HTTP_404_NOT_FOUND)
-            except:
-                exc_info = sys.exc_info()
-                traceback.print_exception(*exc_info)
-                logger.error("Error processing %s for token %s" % (request.data, token))
-                return Response(serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        deduplicator = get_deduplicator()
+        update_id = request.data.get('update_id') if isinstance(request.data, dict) else None
+        if deduplicator and update_id is not None:
+            if not deduplicator.claim(token, update_id):
+                logger.info("Duplicate update %s for token %s ignored" % (update_id, token))
+                return Response(status=status.HTTP_200_OK)
+        response = None
+        try:
+            if ingestion.get_ingestion_mode() != ingestion.SYNC:
+                response = self.enqueue(request, token)
             else:
-                return Response(serializer.data, status=status.HTTP_200_OK)
-        logger.error("Validation error: %s from message %s" % (serializer.errors, request.data))
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                response = self.process(request, token)
+        finally:
+            if deduplicator and update_id is not None and getattr(response, 'status_code', None) != status.HTTP_200_OK:
+                #  Not processed, let Telegram deliver it again
+                deduplicator.release(token, update_id)
+        return response
+    
+    def process(self, request, token):
+        try:
+            update = decode_update(request.data)
+        except UpdateDecodeError as e:
+            logger.error("Validation error: %s from message %s" % (e.errors, request.data))
+            return Response(e.errors, status=status.HTTP_400_BAD_REQUEST)
+        UpdateSerializer.save_update(update)
+        try:
+            bot = registry.get(token)
+            bot.handle(update)
+        except Bot.DoesNotExist:
+            logger.warning("Token %s not associated to a bot" % token)
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        except:
+            exc_info = sys.exc_info()
+            traceback.print_exception(*exc_info)
+            logger.error("Error processing %s for token %s" % (update, token))
+            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(status=status.HTTP_200_OK)
+    
+    def enqueue(self, request, token):
+        """
+        Check the update and hand it to the ingestion backend, answering Telegram right away.
+        """
+        if not isinstance(request.data, dict) or 'update_id' not in request.data or not request.data.get('message'):
+            logger.error("Validation error: not an update %s" % request.data)
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            registry.get(token)
+        except Bot.DoesNotExist:
+            logger.warning("Token %s not associated to a bot" % token)
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        if not ingestion.enqueue_update(token, request.data):
+            logger.warning("Ingestion queue full, update %s for token %s rejected" % (request.data['update_id'], token))
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(status=status.HTTP_200_OK)
     
     
 class AuthView(generic.TemplateView):
@@ -47,6 +87,7 @@ class AuthView(generic.TemplateView):
         return Bot.objects.get(user_api__username=name)    
     
     def get_token(self, user):
+        AuthToken.objects.delete_expired_periodically()
         token, created = AuthToken.objects.get_or_create(user=user)
         if not created and token.expired():
             token.delete()
@@ -1,5 +1,6 @@
 from tests.commands_views import StartView, AuthorCommandView, AuthorInverseListView, AuthorCommandQueryView, \
-    UnknownView, AuthorName, MessageView
+    UnknownView, AuthorName, MessageView, AuthorKeyboardListView, AuthorPageCommandView, \
+    AuthorPageListView
 from telegrambot.handlers import command, unknown_command, regex, message 
 from telegrambot.bot_views.decorators import login_required
 
@@ -7,6 +8,9 @@ urlpatterns = [
     command('start', StartView.as_command_view()),
     command('author_inverse', AuthorInverseListView.as_command_view()),
     command('author_query', AuthorCommandQueryView.as_command_view()),
+    command('author_keyboard', AuthorKeyboardListView.as_command_view()),
+    command('author_list', AuthorPageListView.as_command_view()),
+    command('author_page', AuthorPageCommandView.as_command_view()),
     regex(r'^author_(?P<name>\w+)', AuthorName.as_command_view()),
     command('author_auth', login_required(AuthorCommandView.as_command_view())),
     command('author', AuthorCommandView.as_command_view()), 
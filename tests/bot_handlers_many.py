@@ -0,0 +1,6 @@
+from tests.commands_views import StartView, MessageView
+from telegrambot.handlers import command, message
+
+urlpatterns = [command('command_%03d' % i, StartView.as_command_view()) for i in range(500)] + [
+    message(MessageView.as_command_view())
+]
@@ -1,9 +1,12 @@
 from telegrambot.bot_views.generic import TemplateCommandView, ListCommandView, DetailCommandView, \
     ListDetailCommandView
+from telegrambot.bot_views.generic import CommandKeyboard
 from tests.models import Author
 
 class StartView(TemplateCommandView):
     template_text = "bot/messages/command_start_text.txt"
+    context_free = True
+    cache_response = True
     
 class UnknownView(TemplateCommandView):
     template_text = "bot/messages/command_unknown_text.txt"
@@ -17,6 +20,14 @@ class AuthorListView(ListCommandView):
 class AuthorInverseListView(AuthorListView):
     ordering = "-name"
 
+class AuthorKeyboardListView(AuthorListView):
+    template_keyboard = None
+    keyboard = CommandKeyboard('author', 'authors', field='name', per_line=2)
+    
+class AuthorPageListView(AuthorListView):
+    paginate_by = 2
+    ordering = ('name',)
+    
 class AuthorDetailView(DetailCommandView):
     template_text = "bot/messages/command_author_detail_text.txt"
     context_object_name = "author"
@@ -33,6 +44,10 @@ class AuthorCommandView(ListDetailCommandView):
     list_view_class = AuthorListView
     detail_view_class = AuthorDetailView
 
+class AuthorPageCommandView(ListDetailCommandView):
+    list_view_class = AuthorPageListView
+    detail_view_class = AuthorDetailView
+
 class AuthorCommandQueryView(ListDetailCommandView):
     list_view_class = AuthorListQueryView
     detail_view_class = AuthorDetailQueryView
@@ -0,0 +1,82 @@
+"""
+Local Bot API server answering ``sendMessage``, ``getMe``, ``setWebhook`` and ``getWebhookInfo`` over
+keep-alive connections.
+"""
+from django.utils.six.moves import BaseHTTPServer, socketserver
+import json
+import threading
+
+
+class FakeBotAPIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.requests += 1
+        method = self.path.rsplit('/', 1)[-1]
+        status, body = 200, {'ok': True, 'result': True}
+        if self.server.error:
+            status, body = 400, {'ok': False, 'description': self.server.error}
+        elif method == 'getMe':
+            body['result'] = {'id': 1, 'first_name': 'fake', 'username': 'fake_bot'}
+        elif method == 'setWebhook':
+            self.server.webhook_url = json.loads(data.decode('utf-8') or '{}').get('url', '')
+        elif method == 'getWebhookInfo':
+            body['result'] = {'url': self.server.webhook_url, 'has_custom_certificate': False,
+                              'pending_update_count': 0}
+        elif method == 'sendMessage':
+            body['result'] = {'message_id': self.server.requests, 'date': 1441645532,
+                              'chat': {'id': 1, 'type': 'private'},
+                              'from': {'id': 1, 'first_name': 'fake'}, 'text': 'text'}
+        data = json.dumps(body).encode('utf-8')
+        if self.server.truncate_responses and self.server.requests > 1:
+            #  Dies after processing the request, while sending the response
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:5])
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if self.server.drop_connections:
+            #  Close without telling the client, as servers do with idle keep-alive connections
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeBotAPIServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), FakeBotAPIHandler)
+        self.connections = 0
+        self.requests = 0
+        self.error = None
+        self.drop_connections = False
+        self.truncate_responses = False
+        self.webhook_url = ''
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d/bot' % self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks of the hot paths. Timings are written to stderr, assertions only cover
+differences large enough not to depend on the machine.
+"""
+from telegrambot.serializers import UpdateSerializer, decode_update, update_data
+from telegrambot.models import User, Chat, Message, Update, AuthToken
+from telegrambot.test import factories
+from telegrambot import persistence
+from telegrambot.handlers import HandlerResolver, get_resolver, clear_resolver_cache
+from telegrambot.bot_views.generic import responses, TextResponse, KeyboardResponse, CommandKeyboard
+from telegrambot.bot_views.generic.responses import keyboard_markup
+from tests.commands_views import AuthorListView
+from tests.models import Author
+from tests.fake_api import FakeBotAPIServer
+from telegrambot.transport import PooledBotAPI, PooledTransport
+from django.utils.six.moves.urllib.request import Request, urlopen
+import json
+from rest_framework.parsers import JSONParser
+from django.http.request import HttpRequest
+from django.template import RequestContext, TemplateDoesNotExist
+from django.template.loader import get_template
+from django.test.utils import override_settings
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import BytesIO
+from timeit import default_timer
+import telegram
+import sys
+
+
+def measure(func, number=200):
+    """
+    Mean wall time in microseconds of ``number`` calls to ``func``.
+    """
+    func()
+    start = default_timer()
+    for _ in range(number):
+        func()
+    return (default_timer() - start) * 1e6 / number
+
+
+def report(name, **timings):
+    sys.stderr.write("\nbenchmark %s: %s\n" % (name, ", ".join("%s=%.1fus" % item for item in sorted(timings.items()))))
+
+
+class TestDecodeBenchmark(SimpleTestCase):
+    
+    def setUp(self):
+        self.payload = factories.UpdateLibFactory().to_json().encode('utf-8')
+    
+    def test_decode_update(self):
+        def drf_pipeline():
+            data = JSONParser().parse(BytesIO(self.payload))
+            serializer = UpdateSerializer(data=data)
+            serializer.is_valid(raise_exception=True)
+            return telegram.Update.de_json(data)
+            
+        def single_decode():
+            return decode_update(self.payload)
+        
+        before = measure(drf_pipeline)
+        after = measure(single_decode)
+        report('decode_update', drf=before, single=after)
+        self.assertLess(after, before)
+
+
+def legacy_create(validated_data):
+    """
+    ``UpdateSerializer.create`` before upserts were used.
+    """
+    user, _ = User.objects.get_or_create(**validated_data['message']['from_user'])
+    chat, created = Chat.objects.get_or_create(**validated_data['message']['chat'])
+    splitted_message = validated_data['message']['text'].split(' ')
+    if len(splitted_message) > 1 and splitted_message[0] == '/start':
+        try:
+            token = AuthToken.objects.get(key=splitted_message[1])
+            token.chat_api = chat
+            token.save()
+        except AuthToken.DoesNotExist:
+            pass
+    message, _ = Message.objects.get_or_create(message_id=validated_data['message']['message_id'],
+                                               from_user=user,
+                                               date=validated_data['message']['date'],
+                                               chat=chat,
+                                               text=validated_data['message']['text'])
+    update, _ = Update.objects.get_or_create(update_id=validated_data['update_id'],
+                                             message=message)
+    return update
+
+
+class TestPersistenceBenchmark(TransactionTestCase):
+    
+    def setUp(self):
+        persistence.clear_caches()
+        
+    def round_trips(self, create, updates):
+        with CaptureQueriesContext(connection) as queries:
+            for update in updates:
+                create(update_data(update))
+        return float(len(queries)) / len(updates)
+    
+    def conversation(self, size=10):
+        first = factories.UpdateLibFactory()
+        updates = [first]
+        for _ in range(size - 1):
+            update = factories.UpdateLibFactory()
+            update.message.from_user = first.message.from_user
+            update.message.chat = first.message.chat
+            updates.append(update)
+        return updates
+    
+    def test_round_trips(self):
+        before = self.round_trips(legacy_create, self.conversation())
+        after = self.round_trips(persistence.save_update, self.conversation())
+        sys.stderr.write("\nbenchmark save_update round trips per update (%s): legacy=%.1f, upsert=%.1f\n" %
+                         (connection.vendor, before, after))
+        self.assertLess(after, before)
+        
+    def test_unchanged_user_and_chat_skipped(self):
+        first, second = self.conversation(2)
+        persistence.save_update(update_data(first))
+        with CaptureQueriesContext(connection) as queries:
+            persistence.save_update(update_data(second))
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn(User._meta.db_table, tables)
+        self.assertNotIn(Chat._meta.db_table, tables)
+        self.assertIn(Message._meta.db_table, tables)
+        self.assertEqual(2, Message.objects.count())
+
+
+class TestResolverBenchmark(SimpleTestCase):
+    conf = 'tests.bot_handlers_many'
+    
+    def setUp(self):
+        self.update = factories.UpdateLibFactory()
+        self.update.message.text = '/command_499 param'
+        
+    def test_resolve(self):
+        clear_resolver_cache()
+        start = default_timer()
+        get_resolver(self.conf).resolve(self.update)
+        cold = (default_timer() - start) * 1e6
+        rebuilt = measure(lambda: HandlerResolver(self.conf).resolve(self.update), number=50)
+        warm = measure(lambda: get_resolver(self.conf).resolve(self.update), number=50)
+        report('resolve 500 handlers', cold=cold, rebuilt_per_update=rebuilt, warm=warm)
+        self.assertIs(get_resolver(self.conf), get_resolver(self.conf))
+        callback, args, kwargs = get_resolver(self.conf).resolve(self.update)
+        self.assertEqual('param', kwargs['param'])
+
+
+def legacy_render(template_name, ctx):
+    """
+    ``TemplateResponse.render`` before templates were cached.
+    """
+    try:
+        template = get_template(template_name)
+    except TemplateDoesNotExist:
+        return None
+    return template.render(RequestContext(HttpRequest(), ctx))
+
+
+@override_settings(TELEGRAM_BOT_TEMPLATE_CACHE=True)
+class TestRenderBenchmark(SimpleTestCase):
+    
+    def setUp(self):
+        responses.clear_template_cache()
+        self.ctx = {'authors': [Author(name='author_%d' % i) for i in range(10)]}
+        
+    def test_render_reply(self):
+        def legacy():
+            return (legacy_render(AuthorListView.template_text, self.ctx),
+                    legacy_render(AuthorListView.template_keyboard, self.ctx),
+                    legacy_render('missing_keyboard.txt', self.ctx))
+            
+        def cached():
+            return (TextResponse(AuthorListView.template_text, self.ctx).render(),
+                    KeyboardResponse(AuthorListView.template_keyboard, self.ctx).render(),
+                    TextResponse('missing_keyboard.txt', self.ctx).render())
+        
+        self.assertEqual(legacy()[0], cached()[0])
+        before = measure(legacy)
+        after = measure(cached)
+        report('render reply', legacy=before, cached=after)
+        self.assertLess(after, before)
+
+    def test_large_keyboard(self):
+        ctx = {'authors': [Author(name='author_%d' % i) for i in range(500)]}
+        keyboard = CommandKeyboard('author', 'authors', field='name')
+        
+        def template():
+            return KeyboardResponse(AuthorListView.template_keyboard, ctx).render()
+        
+        def native():
+            return keyboard_markup(keyboard.rows(ctx))
+        
+        self.assertEqual(template().keyboard, native().keyboard)
+        before = measure(template, number=20)
+        after = measure(native, number=20)
+        report('keyboard 500 buttons', template=before, native=after)
+        self.assertLess(after, before)
+
+
+def legacy_send(url, data):
+    """
+    ``telegram.utils.request.post``: a new connection for every request.
+    """
+    request = Request(url, data=json.dumps(data).encode(), headers={'Content-Type': 'application/json'})
+    return json.loads(urlopen(request, timeout=5).read().decode('utf-8'))['result']
+
+
+class TestTransportBenchmark(SimpleTestCase):
+    token = '174446943:AAEcMXep4Uc51sAkYcTJC7vEoLmmxwnQgcc'
+    
+    def test_send_message(self):
+        with FakeBotAPIServer() as server:
+            api = PooledBotAPI(self.token, server.base_url, PooledTransport(pool_size=1, timeout=5))
+            url = '%s/sendMessage' % api.base_url
+            before = measure(lambda: legacy_send(url, {'chat_id': 1, 'text': 'text'}), number=100)
+            connections = server.connections
+            after = measure(lambda: api.sendMessage(chat_id=1, text='text'), number=100)
+            pooled_connections = server.connections - connections
+        report('sendMessage to local server', new_connection=before, pooled=after)
+        self.assertEqual(1, pooled_connections)
+        self.assertLess(after, before)
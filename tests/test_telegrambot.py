@@ -1,14 +1,56 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-from telegrambot.models import User, Chat, Bot, AuthToken
+from telegrambot.models import (User, Chat, Bot, AuthToken, Update, Message, QueuedUpdate, OutboxMessage, Broadcast,
+                                BroadcastDelivery)
+from telegrambot.admin import EstimatedCountPaginator, estimated_rows
+from telegrambot.broadcast import BroadcastEngine
+from telegrambot.test.factories import AuthTokenFactory
+from django.utils.six import StringIO
+from telegrambot.ingestion import WorkerPool
+from telegrambot.registry import registry
+from telegrambot.serializers import UpdateDecodeError, decode_update, update_data
+from telegrambot import auth_cache, codec, ingestion, persistence, retention
+from telegrambot.persistence import WriteBehindBuffer
+from telegrambot.deduplication import UpdateDeduplicator
+from telegrambot.outbound import OutboundDispatcher, TokenBucket
+from telegrambot.resilience import (CircuitBreaker, CircuitOpen, get_client, is_timeout, is_transient, reset_breakers,
+                                    retry_after)
+from telegrambot.outbox import drain_outbox
+from telegrambot.transport import PooledBotAPI, PooledTransport, closed_without_response, get_api, close_transports
+from django.utils.six.moves import http_client
+from telegram import ReplyKeyboardMarkup
+from tests.fake_api import FakeBotAPIServer
+from telegram.error import TelegramError
+from telegrambot.handlers import get_resolver, HandlerResolver, HandlerNotFound, command, regex, message
+from django.core.urlresolvers import RegexURLResolver
+from django.template import TemplateDoesNotExist
+from telegrambot.bot_views.generic import responses, TextResponse, KeyboardResponse, CommandKeyboard, StaticKeyboard
+from telegrambot.bot_views.generic.list import is_cursor, encode_cursor
+from tests.commands_views import StartView, AuthorListView, AuthorPageListView, AuthorDetailView, UnknownView
+from telegrambot.bot_views.generic import caching
+from telegrambot.bot_views.generic.caching import ResponseCache, get_response_cache, clear_response_caches
+from django.core.cache import caches
+from django.db import connections
+from django.db.models.signals import post_save, post_delete
+from django.test import SimpleTestCase
 from telegrambot.test import factories, testcases   
 from factory import DjangoModelFactory, Sequence
 from tests.models import Author
 from django.core.urlresolvers import reverse
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from django.test.utils import override_settings
 from django.conf import settings
+from django.utils import timezone
 from django.apps import apps
+from django.core.management import call_command, CommandError
+from datetime import timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
 try:
     from unittest import mock
 except ImportError:
@@ -27,7 +69,11 @@ class TestBot(testcases.BaseTestBot):
     
     def test_enable_webhook(self):
         self.assertTrue(self.bot.enabled)
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()):
+            self.bot.enabled = False
+            self.bot.save()
         with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()) as mock_setwebhook:
+            self.bot.enabled = True
             self.bot.save()
             args, kwargs = mock_setwebhook.call_args
             self.assertEqual(1, mock_setwebhook.call_count)
@@ -43,6 +89,36 @@ class TestBot(testcases.BaseTestBot):
             self.assertEqual(1, mock_setwebhook.call_count)
             self.assertEqual(None, kwargs['webhook_url'])
             self.assertEqual(None, kwargs['certificate'])
+
+    def test_webhook_unchanged(self):
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()) as mock_setwebhook:
+            self.bot.save()
+            Bot.objects.get(pk=self.bot.pk).save()
+            self.assertEqual(0, mock_setwebhook.call_count)
+
+    def test_webhook_token_changed(self):
+        bot = Bot.objects.get(pk=self.bot.pk)
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()) as mock_setwebhook:
+            bot.token = '123:other'
+            bot.save()
+            self.assertEqual(1, mock_setwebhook.call_count)
+            self.assertIn('123:other', mock_setwebhook.call_args[1]['webhook_url'])
+
+    def test_create_single_webhook(self):
+        Bot.objects.all().delete()
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()) as mock_setwebhook:
+            bot = Bot.objects.create(token='123:created')
+            self.assertEqual(1, mock_setwebhook.call_count)
+        self.assertEqual(u'oscartest_bot', bot.user_api.username)
+
+    def test_webhook_retried_after_transient_error(self):
+        with mock.patch("telegram.bot.Bot.setWebhook", side_effect=TelegramError('Bad Gateway')), \
+                mock.patch('time.sleep'):
+            self.bot.enabled = False
+            self.bot.save()
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()) as mock_setwebhook:
+            self.bot.save()
+            self.assertEqual(1, mock_setwebhook.call_count)
             
     def test_bot_user_api(self):
         with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()):
@@ -61,6 +137,16 @@ class TestBot(testcases.BaseTestBot):
         del self.update.message
         response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
         self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        
+    def test_malformed_update(self):
+        data = codec.loads(self.update.to_json())
+        data['message']['from'] = 1
+        response = self.client.post(self.webhook_url, codec.dumps(data), **self.kwargs)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        data = codec.loads(self.update.to_json())
+        data['update_id'] = 'abc'
+        response = self.client.post(self.webhook_url, codec.dumps(data), **self.kwargs)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
     
 class TestBotCommands(testcases.BaseTestBot): 
     
@@ -141,6 +227,14 @@ class TestBotCommands(testcases.BaseTestBot):
         AuthorFactory(name="author_1")
         self._test_message_ok(self.author_detail_query)
         
+    def test_author_list_native_keyboard(self):
+        AuthorFactory(name="author_1")
+        AuthorFactory(name="author_2")
+        self._test_message_ok({'in': '/author_keyboard',
+                               'out': {'parse_mode': 'Markdown',
+                                       'reply_markup': '/author author_1',
+                                       'text': "Select from list:\nauthor_1\nauthor_2"}})
+        
     def test_several_commands_from_same_user_and_chat(self):
         self._test_message_ok(self.start)
         user = self.update.message.from_user
@@ -174,7 +268,759 @@ class TestBotNoHandlers(testcases.BaseTestBot):
         
     def test_no_handler(self):
         self._test_message_no_handler(self.any_message)
+        
+
+class TestCommandDispatch(testcases.BaseTestBot):
+    
+    def resolve(self, conf, text):
+        self.update.message.text = text
+        return HandlerResolver(conf).resolve(self.update)
+    
+    def test_same_match_as_regex_scan(self):
+        conf = settings.TELEGRAM_BOT_HANDLERS_CONF
+        scan = RegexURLResolver(r'^', conf)
+        for text in ['/start', '/start now', '/author', '/author author_1', '/author  author_1 more',
+                     '/author_inverse', '/author_query author_1', '/author_auth', '/authorx', '/author-x',
+                     '/author_other', '/no_defined', 'author_name', 'any text', '/']:
+            expected = scan.resolve(text)
+            match = self.resolve(conf, text)
+            self.assertEqual((expected.func, expected.args, expected.kwargs),
+                             (match.func, match.args, match.kwargs), text)
+            
+    def test_bot_name(self):
+        func, args, kwargs = self.resolve(settings.TELEGRAM_BOT_HANDLERS_CONF, '/author@my_bot author_1')
+        self.assertEqual(func, self.resolve(settings.TELEGRAM_BOT_HANDLERS_CONF, '/author').func)
+        self.assertEqual({'param': 'author_1'}, kwargs)
+        
+    def test_earlier_patterns_first(self):
+        views = dict((name, mock.Mock(__name__=name)) for name in ['regex', 'start', 'now', 'stop', 'message'])
+        conf = [regex(r'^/start_(?P<name>\w+)', views['regex']), command('start', views['start']),
+                command('start_now', views['now']), command('stop', views['stop']), message(views['message'])]
+        self.assertEqual(views['regex'], self.resolve(conf, '/start_now').func)
+        self.assertEqual(views['start'], self.resolve(conf, '/start').func)
+        self.assertEqual(views['stop'], self.resolve(conf, '/stop').func)
+        self.assertEqual(views['message'], self.resolve(conf, 'stop').func)
+        
+    def test_not_found(self):
+        self.assertRaises(HandlerNotFound, self.resolve, [command('start', lambda: None)], '/stop')
+        self.assertRaises(HandlerNotFound, self.resolve, [command('start', lambda: None)], 'start')
+        
+
+class TestResolverCache(testcases.BaseTestBot):
+    
+    def test_resolver_reused(self):
+        self.assertIs(get_resolver(settings.TELEGRAM_BOT_HANDLERS_CONF),
+                      get_resolver(settings.TELEGRAM_BOT_HANDLERS_CONF))
+        
+    def test_clear_on_settings_change(self):
+        resolver = get_resolver(settings.TELEGRAM_BOT_HANDLERS_CONF)
+        with override_settings(TELEGRAM_BOT_HANDLERS_CONF='tests.bot_handlers_empty'):
+            pass
+        self.assertIsNot(resolver, get_resolver(settings.TELEGRAM_BOT_HANDLERS_CONF))
+
+
+class TestBotHandlersConf(testcases.BaseTestBot):
+    
+    def test_default_conf(self):
+        self.assertEqual(settings.TELEGRAM_BOT_HANDLERS_CONF, self.bot.get_handlers_conf())
+        self.assertIs(get_resolver(settings.TELEGRAM_BOT_HANDLERS_CONF), self.bot.resolver)
+        
+    def test_bot_conf(self):
+        self.bot.handlers_conf = 'tests.bot_handlers_empty'
+        self.bot.save()
+        registry.clear()
+        self.assertEqual('tests.bot_handlers_empty', registry.get(self.bot.token).resolver.resolver.urlconf_name)
+        self._test_message_no_handler({'in': '/start'})
+        
+    def test_resolver_kept_on_bot(self):
+        resolver = self.bot.resolver
+        with mock.patch('telegrambot.models.bot.get_resolver') as mock_get_resolver:
+            self.assertIs(resolver, self.bot.resolver)
+            self.assertEqual(0, mock_get_resolver.call_count)
+
+class TestTemplateCache(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestTemplateCache, self).setUp()
+        responses.clear_template_cache()
+        
+    def tearDown(self):
+        responses.clear_template_cache()
+        
+    @override_settings(TELEGRAM_BOT_TEMPLATE_CACHE=True)
+    def test_missing_template_cached(self):
+        with mock.patch('telegrambot.bot_views.generic.responses.get_template',
+                        side_effect=TemplateDoesNotExist('missing.txt')) as mock_get_template:
+            self.assertIsNone(TextResponse('missing.txt').render())
+            self.assertIsNone(TextResponse('missing.txt').render())
+        self.assertEqual(1, mock_get_template.call_count)
+        
+    @override_settings(TELEGRAM_BOT_TEMPLATE_CACHE=True)
+    def test_template_cached(self):
+        template = responses.load_template(StartView.template_text)
+        self.assertIs(template, responses.load_template(StartView.template_text))
+        
+    @override_settings(TELEGRAM_BOT_TEMPLATE_CACHE=False)
+    def test_cache_disabled(self):
+        self.assertIsNot(responses.load_template(StartView.template_text),
+                         responses.load_template(StartView.template_text))
+        
+    def test_context_processors(self):
+        template = mock.MagicMock()
+        with mock.patch('telegrambot.bot_views.generic.responses.load_template', return_value=template):
+            TextResponse('text.txt', {'a': 1}).render()
+            self.assertEqual(mock.call({'a': 1}), template.render.call_args)
+            TextResponse('text.txt', {'a': 1}, use_context_processors=True).render()
+            self.assertIn('request', template.render.call_args[1])
+
+class TestKeyboards(SimpleTestCase):
+    
+    def test_command_keyboard(self):
+        authors = [Author(name='author_%d' % i) for i in range(3)]
+        keyboard = CommandKeyboard('author', 'authors', field='name', per_line=2)
+        self.assertEqual([['/author author_0', '/author author_1'], ['/author author_2']],
+                         keyboard.rows({'authors': authors}))
+        self.assertEqual([], keyboard.rows(None))
+        
+    def test_same_as_template_filter(self):
+        authors = [Author(name='author_%d' % i) for i in range(3)]
+        rendered = KeyboardResponse(AuthorListView.template_keyboard, {'authors': authors}).render()
+        self.assertEqual(rendered.keyboard, CommandKeyboard('author', 'authors', field='name').rows({'authors': authors}))
+        
+    def test_memoized_per_key(self):
+        keyboard = CommandKeyboard('author', 'authors', field='name', key='page')
+        with mock.patch.object(keyboard, 'build', return_value=[['/author a']]) as mock_build:
+            keyboard.rows({'page': 1})
+            keyboard.rows({'page': 1})
+            keyboard.rows({'page': 2})
+        self.assertEqual(2, mock_build.call_count)
+        
+    def test_static_keyboard(self):
+        self.assertEqual([['/start']], StaticKeyboard([['/start']]).rows({}))
+
+class TestPagination(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestPagination, self).setUp()
+        for name in ['author_c', 'author_a', 'author_e', 'author_b', 'author_d']:
+            AuthorFactory(name=name)
+    
+    def page(self, view, text):
+        self.update.message.text = text
+        cursor = text.split(' ')[1] if ' ' in text else None
+        ctx = view(cursor).get_context(None, self.update)
+        return [author.name for author in ctx['authors']], ctx['page']
+    
+    def test_pages_forward_and_back(self):
+        names, page = self.page(AuthorPageListView, '/author_page')
+        self.assertEqual(['author_a', 'author_b'], names)
+        self.assertFalse(page['has_previous'])
+        names, page = self.page(AuthorPageListView, page['next'])
+        self.assertEqual(['author_c', 'author_d'], names)
+        self.assertTrue(page['has_previous'])
+        names, last = self.page(AuthorPageListView, page['next'])
+        self.assertEqual(['author_e'], names)
+        self.assertFalse(last['has_next'])
+        names, page = self.page(AuthorPageListView, last['previous'])
+        self.assertEqual(['author_c', 'author_d'], names)
+        self.assertTrue(page['has_next'])
+        names, page = self.page(AuthorPageListView, page['previous'])
+        self.assertEqual(['author_a', 'author_b'], names)
+        self.assertFalse(page['has_previous'])
+        
+    def test_ties_broken_by_pk(self):
+        Author.objects.update(name='same')
+        view = type('View', (AuthorPageListView,), {'ordering': '-name'})
+        pks, text = [], '/author_page'
+        for _ in range(3):
+            self.update.message.text = text
+            ctx = view(text.split(' ')[1] if ' ' in text else None).get_context(None, self.update)
+            pks.extend(author.pk for author in ctx['authors'])
+            text = ctx['page']['next']
+        self.assertEqual(sorted(Author.objects.values_list('pk', flat=True)), pks)
+        self.assertIsNone(text)
+        
+    def test_one_query_per_page(self):
+        names, page = self.page(AuthorPageListView, '/author_page')
+        with self.assertNumQueries(1):
+            self.page(AuthorPageListView, page['next'])
+        
+    def test_navigation_buttons(self):
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.update.message.text = '/author_page'
+            self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        keyboard = mock_send.call_args[1]['reply_markup'].keyboard
+        self.assertInKeyboard('/author author_a', keyboard)
+        self.assertEqual(1, len(keyboard[-1]))
+        self.assertTrue(keyboard[-1][0].startswith('/author_page >'))
+        self.update = factories.UpdateLibFactory()
+        self._test_message_ok({'in': keyboard[-1][0],
+                               'out': {'parse_mode': 'Markdown',
+                                       'reply_markup': '/author author_c',
+                                       'text': "Select from list:\nauthor_c\nauthor_d"}}, number=2)
+        
+    def test_standalone_list_view(self):
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.update.message.text = '/author_list'
+            self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        next_page = mock_send.call_args[1]['reply_markup'].keyboard[-1][0]
+        self.assertTrue(next_page.startswith('/author_list >'))
+        self.update = factories.UpdateLibFactory()
+        self._test_message_ok({'in': next_page,
+                               'out': {'parse_mode': 'Markdown',
+                                       'reply_markup': '/author author_c',
+                                       'text': "Select from list:\nauthor_c\nauthor_d"}}, number=2)
+        
+    def test_detail_still_routed(self):
+        self._test_message_ok({'in': '/author_page author_b',
+                               'out': {'parse_mode': 'Markdown',
+                                       'reply_markup': '',
+                                       'text': "Author name:author_b"}})
+        
+    def test_invalid_cursor(self):
+        self.assertFalse(is_cursor('>not json'))
+        self.assertFalse(is_cursor('author_b'))
+        self.assertTrue(is_cursor(encode_cursor('>', ['a', 1])))
+
+class AuthorCachedDetailView(AuthorDetailView):
+    cache_timeout = 60
+
+
+class TestDetailCache(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestDetailCache, self).setUp()
+        caches['default'].clear()
+        self.author = AuthorFactory(name='author_1')
+        
+    def get(self, slug, view=AuthorCachedDetailView):
+        return view(slug).get_context(None, self.update)['author']
+    
+    def test_hit(self):
+        self.assertEqual(self.author, self.get('author_1'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.author, self.get('author_1'))
+            
+    def test_miss_cached(self):
+        self.assertIsNone(self.get('author_2'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.get('author_2'))
+            
+    def test_not_cached_by_default(self):
+        self.get('author_1', AuthorDetailView)
+        with self.assertNumQueries(1):
+            self.get('author_1', AuthorDetailView)
+            
+    def test_invalidated_on_save(self):
+        self.assertIsNone(self.get('author_2'))
+        self.get('author_1')
+        AuthorFactory(name='author_2')
+        self.assertEqual('author_2', self.get('author_2').name)
+        self.author.name = 'renamed'
+        self.author.save()
+        self.assertIsNone(self.get('author_1'))
+        
+    def test_invalidated_on_delete(self):
+        self.get('author_1')
+        self.author.delete()
+        self.assertIsNone(self.get('author_1'))
+
+    def test_watched_when_defined(self):
+        #  As in a process where no cached view ran yet
+        uid = 'telegrambot.detail.%s.default' % Author._meta.label_lower
+        post_save.disconnect(sender=Author, dispatch_uid=uid)
+        post_delete.disconnect(sender=Author, dispatch_uid=uid)
+        caching._connected.discard((Author, 'default'))
+        cache = caches['default']
 
+        class OtherCachedDetailView(AuthorDetailView):
+            cache_timeout = 60
+        generation = caching.get_generation(cache, Author)
+        self.author.save()
+        self.assertNotEqual(generation, caching.get_generation(cache, Author))
+
+class TestResponseCache(testcases.BaseTestBot):
+    
+    start = {'in': '/start',
+             'out': {'parse_mode': 'Markdown',
+                     'reply_markup': '',
+                     'text': "Start command"}}
+    
+    def setUp(self):
+        super(TestResponseCache, self).setUp()
+        clear_response_caches()
+        
+    def test_context_free_view_cached(self):
+        with mock.patch.object(StartView, 'render', autospec=True, side_effect=StartView.render) as mock_render:
+            self._test_message_ok(self.start)
+            self.update = factories.UpdateLibFactory()
+            self._test_message_ok(self.start, number=2)
+        self.assertEqual(1, mock_render.call_count)
+        cache = get_response_cache(StartView)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        
+    def test_timeout(self):
+        cache = ResponseCache()
+        with mock.patch('telegrambot.bot_views.generic.caching.time.time', return_value=1000):
+            cache.set('key', 'response', 10)
+            self.assertEqual('response', cache.get('key'))
+        with mock.patch('telegrambot.bot_views.generic.caching.time.time', return_value=1011):
+            self.assertIsNone(cache.get('key'))
+        cache.set('key', 'response', None)
+        self.assertEqual('response', cache.get('key'))
+        
+    def test_key_from_context(self):
+        class View(AuthorDetailView):
+            cache_response = True
+            
+            def get_response_cache_key(self, ctx):
+                return ctx['author'] and ctx['author'].pk
+        AuthorFactory(name='author_1')
+        ctx = View('author_1').get_context(None, self.update)
+        text, keyboard = View().get_response(ctx)
+        self.assertIn('author_1', text)
+        self.assertIs(text, View().get_response(ctx)[0])
+        cache = get_response_cache(View)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        
+    def test_not_cached_by_default(self):
+        view = UnknownView()
+        self.assertIsNone(view.get_response_cache_key(None))
+        view.get_response(None)
+        self.assertEqual(0, len(get_response_cache(UnknownView)))
+
+class TestOutbound(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestOutbound, self).setUp()
+        self.dispatcher = OutboundDispatcher(workers=1)
+        
+    def submit(self, chat_id, text, priority=0):
+        return self.dispatcher.submit(self.bot, chat_id, {'text': text}, priority)
+        
+    def drain(self, now):
+        texts = []
+        while True:
+            message, wait = self.dispatcher._next(now)
+            if message is None:
+                return texts
+            texts.append(message.kwargs['text'])
+    
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1)
+        self.assertEqual(0, bucket.wait(100))
+        bucket.consume(100)
+        self.assertAlmostEqual(1, bucket.wait(100))
+        self.assertAlmostEqual(0.5, bucket.wait(100.5))
+        self.assertEqual(0, bucket.wait(101))
+        
+    def test_retry_after(self):
+        self.assertEqual(5, retry_after(TelegramError('Too Many Requests: retry after 5')))
+        self.assertIsNone(retry_after(TelegramError('Bad Gateway')))
+        
+    def test_priority(self):
+        self.submit(1, 'low', 5)
+        self.submit(2, 'high', 0)
+        self.submit(3, 'high_2', 0)
+        self.assertEqual(['high', 'high_2', 'low'], self.drain(1000))
+        
+    def test_private_chat_limit(self):
+        self.submit(1, 'first')
+        self.submit(1, 'second')
+        self.submit(2, 'other')
+        self.assertEqual(['first', 'other'], self.drain(1000))
+        self.assertEqual(1, self.dispatcher.qsize())
+        self.assertEqual(['second'], self.drain(1001))
+        
+    def test_group_limit(self):
+        for i in range(21):
+            self.submit(-1, 'group_%d' % i)
+        self.assertEqual(20, len(self.drain(1000)))
+        self.assertEqual([], self.drain(1002))
+        self.assertEqual(['group_20'], self.drain(1003))
+        
+    def test_channel_username(self):
+        self.submit('@channel', 'first')
+        self.submit('@channel', 'second')
+        self.assertEqual(['first', 'second'], self.drain(1000))
+        self.dispatcher.start()
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.submit('@channel', 'sent')
+            self.submit(1, 'next')
+            self.assertTrue(self.dispatcher.join(5))
+        self.dispatcher.stop()
+        self.assertEqual(2, mock_send.call_count)
+        
+    def test_bot_limit(self):
+        for i in range(31):
+            self.submit(i + 1, 'chat_%d' % i)
+        self.assertEqual(30, len(self.drain(1000)))
+        self.assertEqual(['chat_30'], self.drain(1000.1))
+        
+    def test_rate_limited_by_telegram(self):
+        message = self.submit(1, 'text')
+        self.drain(time.time())
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=TelegramError('Too Many Requests: retry after 30')):
+            self.dispatcher.deliver(message)
+        self.assertEqual(1, self.dispatcher.retried)
+        self.submit(2, 'other')
+        self.assertEqual([], self.drain(time.time()))
+        self.assertEqual(2, self.dispatcher.qsize())
+        self.assertEqual(['text', 'other'], self.drain(time.time() + 31))
+        
+    def test_send_message_queued(self):
+        self.dispatcher.start()
+        with mock.patch('telegrambot.models.bot.get_dispatcher', return_value=self.dispatcher):
+            with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+                self.bot.send_message(chat_id=1, text='queued', parse_mode='Markdown')
+                self.assertTrue(self.dispatcher.join(5))
+        self.dispatcher.stop()
+        self.assertEqual(1, mock_send.call_count)
+        self.assertEqual('queued', mock_send.call_args[1]['text'])
+        stats = self.dispatcher.stats()
+        self.assertEqual((0, 1, 0), (stats['queued'], stats['sent'], stats['failed']))
+        self.assertGreater(stats['latency_max'], 0)
+
+@override_settings(TELEGRAM_BOT_RESILIENCE={'retries': 2, 'failure_threshold': 3, 'reset_timeout': 30})
+class TestResilience(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestResilience, self).setUp()
+        reset_breakers()
+        patcher = mock.patch('telegrambot.resilience.time.sleep')
+        self.mock_sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(reset_breakers)
+        
+    def test_transient(self):
+        self.assertTrue(is_transient(TelegramError('Bad Gateway')))
+        self.assertTrue(is_transient(TelegramError('Too Many Requests: retry after 3')))
+        self.assertTrue(is_transient(IOError('Connection refused')))
+        self.assertFalse(is_transient(TelegramError('Unauthorized')))
+        self.assertFalse(is_transient(TelegramError('Bad Request: chat not found')))
+        
+    def test_retries(self):
+        method = mock.Mock(side_effect=[TelegramError('Bad Gateway'), IOError('reset'), 'ok'])
+        self.assertEqual('ok', get_client('token').call(method, chat_id=1))
+        self.assertEqual(3, method.call_count)
+        self.assertEqual(2, self.mock_sleep.call_count)
+        
+    def test_retries_bounded(self):
+        method = mock.Mock(side_effect=TelegramError('Bad Gateway'))
+        self.assertRaises(TelegramError, get_client('token').call, method)
+        self.assertEqual(3, method.call_count)
+        
+    def test_retry_after(self):
+        method = mock.Mock(side_effect=[TelegramError('Too Many Requests: retry after 2'), 'ok'])
+        self.assertEqual('ok', get_client('token').call(method))
+        self.mock_sleep.assert_called_once_with(2)
+        
+    def test_timeout_retried_if_idempotent(self):
+        method = mock.Mock(side_effect=[TelegramError('Timed out'), 'ok'], __name__='getMe')
+        self.assertEqual('ok', get_client('token').call(method))
+        method = mock.Mock(side_effect=[TelegramError('Timed out'), 'ok'], __name__='sendMessage')
+        self.assertRaises(TelegramError, get_client('token').call, method, chat_id=1, text='text')
+        self.assertEqual(1, method.call_count)
+
+    def test_max_wait(self):
+        method = mock.Mock(side_effect=[TelegramError('Too Many Requests: retry after 3'), 'ok'])
+        self.assertRaises(TelegramError, get_client('token').call, method)
+        self.assertFalse(self.mock_sleep.called)
+        method.side_effect = [TelegramError('Too Many Requests: retry after 3'), 'ok']
+        self.assertEqual('ok', get_client('token', max_wait=None).call(method))
+        self.mock_sleep.assert_called_once_with(3)
+
+    def test_timed_out_message_not_parked(self):
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=TelegramError('Timed out')) as mock_send:
+            self.assertIsNone(self.bot.send_message(chat_id=1, text='text'))
+        self.assertEqual(1, mock_send.call_count)
+        self.assertEqual(0, OutboxMessage.objects.count())
+
+    def test_drain_claimed_skipped(self):
+        self.bot.save()
+        parked = self.bot.park_message(1, {'text': 'text'})
+        OutboxMessage.objects.filter(pk=parked.pk).update(claimed_at=timezone.now())
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.assertEqual(0, drain_outbox())
+            OutboxMessage.objects.filter(pk=parked.pk).update(claimed_at=timezone.now() - timedelta(seconds=301))
+            self.assertEqual(1, drain_outbox())
+        self.assertEqual(1, mock_send.call_count)
+
+    def test_drain_claim_lost(self):
+        self.bot.save()
+        parked = self.bot.park_message(1, {'text': 'text'})
+        other_drainer = lambda message, now: False
+        with mock.patch("telegrambot.outbox.claim", side_effect=other_drainer), \
+                mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.assertEqual(0, drain_outbox())
+        self.assertFalse(mock_send.called)
+        self.assertTrue(OutboxMessage.objects.filter(pk=parked.pk).exists())
+
+    def test_permanent_error_not_retried(self):
+        method = mock.Mock(side_effect=TelegramError('Unauthorized'))
+        self.assertRaises(TelegramError, get_client('token').call, method)
+        self.assertEqual(1, method.call_count)
+        
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        with mock.patch('telegrambot.resilience.time.time', return_value=1000):
+            breaker.failure()
+            self.assertTrue(breaker.allow())
+            breaker.failure()
+            self.assertFalse(breaker.allow())
+        with mock.patch('telegrambot.resilience.time.time', return_value=1031):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.success()
+            self.assertTrue(breaker.allow())
+            
+    def test_fail_fast(self):
+        method = mock.Mock(side_effect=TelegramError('Bad Gateway'))
+        self.assertRaises(TelegramError, get_client('token').call, method)
+        self.assertRaises(CircuitOpen, get_client('token').call, method)
+        self.assertEqual(3, method.call_count)
+        
+    def test_message_parked_while_api_down(self):
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=TelegramError('Bad Gateway')):
+            self.update.message.text = '/start'
+            response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        parked = OutboxMessage.objects.get()
+        self.assertEqual(self.update.message.chat.id, parked.chat_id)
+        self.assertIn('Start command', parked.payload)
+        
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=TelegramError('Bad Gateway')):
+            self.assertEqual(0, drain_outbox())
+        self.assertEqual(1, OutboxMessage.objects.get().attempts)
+        
+        reset_breakers()
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            self.assertEqual(1, drain_outbox())
+        self.assertEqual(0, OutboxMessage.objects.count())
+        self.assertEqual(self.update.message.chat.id, mock_send.call_args[1]['chat_id'])
+        self.assertIn('Start command', mock_send.call_args[1]['text'])
+        
+    def test_permanent_error_raised(self):
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=TelegramError('Bad Request: chat not found')):
+            self.assertRaises(TelegramError, self.bot.send_message, chat_id=1, text='text')
+        self.assertEqual(0, OutboxMessage.objects.count())
+        
+    def test_set_webhook_error_logged(self):
+        with mock.patch("telegram.bot.Bot.setWebhook", side_effect=TelegramError('Timed out')):
+            self.bot.save()
+        self.assertTrue(Bot.objects.get(pk=self.bot.pk).enabled)
+
+class TestPooledTransport(SimpleTestCase):
+    token = '174446943:AAEcMXep4Uc51sAkYcTJC7vEoLmmxwnQgcc'
+    
+    def api(self, server):
+        return PooledBotAPI(self.token, server.base_url, PooledTransport(pool_size=2, timeout=5))
+    
+    def test_connection_reused(self):
+        with FakeBotAPIServer() as server:
+            api = self.api(server)
+            for i in range(5):
+                message = api.sendMessage(chat_id=1, text='text %d' % i,
+                                          reply_markup=ReplyKeyboardMarkup([['/start']]))
+            self.assertEqual('fake_bot', api.getMe().username)
+            self.assertTrue(api.setWebhook(webhook_url='https://example.com/webhook/'))
+        self.assertEqual(7, server.requests)
+        self.assertEqual(1, server.connections)
+        self.assertEqual('text', message.text)
+        
+    def test_error(self):
+        with FakeBotAPIServer() as server:
+            server.error = 'Bad Request: chat not found'
+            with self.assertRaises(TelegramError) as cm:
+                self.api(server).sendMessage(chat_id=1, text='text')
+        self.assertEqual('Bad Request: chat not found', cm.exception.message)
+        
+    def test_closed_connection_replaced(self):
+        with FakeBotAPIServer() as server:
+            server.drop_connections = True
+            api = self.api(server)
+            api.sendMessage(chat_id=1, text='first')
+            api.sendMessage(chat_id=1, text='second')
+        self.assertEqual(2, server.requests)
+        self.assertEqual(2, server.connections)
+        
+    def test_failed_response_not_resent(self):
+        with FakeBotAPIServer() as server:
+            server.truncate_responses = True
+            api = self.api(server)
+            api.sendMessage(chat_id=1, text='first')
+            with self.assertRaises(IOError) as cm:
+                api.sendMessage(chat_id=1, text='second')
+        self.assertEqual(2, server.requests)
+        #  Not retried nor parked
+        self.assertTrue(is_timeout(cm.exception))
+
+    def test_closed_without_response(self):
+        self.assertTrue(closed_without_response(http_client.BadStatusLine("''")))
+        self.assertFalse(closed_without_response(http_client.BadStatusLine('garbage')))
+
+    def test_get_api(self):
+        with override_settings(TELEGRAM_BOT_TRANSPORT=None):
+            self.assertNotIsInstance(get_api(self.token), PooledBotAPI)
+        with override_settings(TELEGRAM_BOT_TRANSPORT={'pool_size': 2}):
+            api = get_api(self.token)
+            self.assertIsInstance(api, PooledBotAPI)
+            self.assertIs(api.transport, get_api(self.token).transport)
+            self.assertEqual(2, api.transport.pool_size)
+        close_transports()
+
+class TestLazyAPI(testcases.BaseTestBot):
+
+    def test_not_built_on_load(self):
+        self.bot.save()
+        with mock.patch('telegrambot.models.bot.get_api') as get_api_mock:
+            bots = list(Bot.objects.all())
+            self.assertFalse(get_api_mock.called)
+            bots[0]._bot
+        get_api_mock.assert_called_once_with(self.bot.token)
+
+    def test_shared_by_token(self):
+        self.bot.save()
+        bot = Bot.objects.get(pk=self.bot.pk)
+        self.assertIs(self.bot._bot, bot._bot)
+        self.assertEqual(self.bot.token, bot._bot.token)
+
+    def test_token_changed(self):
+        api = self.bot._bot
+        self.bot.token = '123:other'
+        self.assertIsNot(api, self.bot._bot)
+        self.assertEqual('123:other', self.bot._bot.token)
+
+    def test_set(self):
+        api = mock.MagicMock()
+        self.bot._bot = api
+        self.assertIs(api, self.bot._bot)
+
+    def test_no_token(self):
+        self.assertIsNone(Bot()._bot)
+
+
+class TestSyncWebhooks(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestSyncWebhooks, self).setUp()
+        reset_breakers()
+        self.server = FakeBotAPIServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.addCleanup(close_transports)
+        self.settings = override_settings(TELEGRAM_BOT_TRANSPORT={'base_url': self.server.base_url})
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def sync(self, **options):
+        out = StringIO()
+        call_command('telegrambot_sync_webhooks', stdout=out, stderr=StringIO(), **options)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        out = self.sync(dry_run=True)
+        self.assertIn("Would set %s: None -> https://" % self.bot, out)
+        self.assertIn("0 in sync, 1 changed, 0 errors", out)
+        self.assertEqual('', self.server.webhook_url)
+
+    def test_sync(self):
+        self.assertIn("0 in sync, 1 changed", self.sync())
+        self.assertEqual(self.bot.get_webhook_url(), self.server.webhook_url)
+        self.assertIn("1 in sync, 0 changed", self.sync())
+
+    def test_disabled(self):
+        self.server.webhook_url = 'https://example.com/old'
+        Bot.objects.filter(pk=self.bot.pk).update(enabled=False)
+        self.assertIn("https://example.com/old -> None", self.sync())
+        self.assertEqual('', self.server.webhook_url)
+
+    def test_error(self):
+        self.server.error = 'Unauthorized'
+        self.assertIn("0 in sync, 0 changed, 1 errors", self.sync())
+
+
+class TestBroadcast(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestBroadcast, self).setUp()
+        reset_breakers()
+        for chat_id in range(1, 6):
+            Chat.objects.create(id=chat_id, type=Chat.PRIVATE, username='chat_%d' % chat_id)
+        self.broadcast = Broadcast.objects.create(bot=self.bot, template_text=StartView.template_text)
+        self.errors = {2: TelegramError('Unauthorized'), 3: TelegramError('Bad Request: chat not found')}
+        
+    def send(self, chat_id, **kwargs):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        return True
+        
+    def run_broadcast(self, broadcast=None, **kwargs):
+        with mock.patch("telegram.bot.Bot.sendMessage", side_effect=self.send) as mock_send:
+            engine = BroadcastEngine(broadcast or self.broadcast, workers=2, rate=1000, chunk_size=2, **kwargs)
+            stats = engine.run(Chat.objects.order_by('id').values_list('id', flat=True).iterator())
+        return stats, sorted(call[1]['chat_id'] for call in mock_send.call_args_list)
+        
+    def statuses(self, broadcast=None):
+        return dict(BroadcastDelivery.objects.filter(broadcast=broadcast or self.broadcast)
+                    .values_list('chat_id', 'status'))
+        
+    def test_broadcast(self):
+        stats, sent_to = self.run_broadcast()
+        self.assertEqual([1, 2, 3, 4, 5], sent_to)
+        self.assertEqual((3, 1, 1), (stats['sent'], stats['failed'], stats['blocked']))
+        self.assertEqual({1: 'sent', 2: 'blocked', 3: 'failed', 4: 'sent', 5: 'sent'}, self.statuses())
+        self.assertIsNotNone(Broadcast.objects.get().finished)
+        
+    def test_resume(self):
+        self.run_broadcast()
+        del self.errors[3]
+        stats, sent_to = self.run_broadcast()
+        self.assertEqual([3], sent_to)
+        self.assertEqual(4, stats['skipped'])
+        self.assertEqual('sent', self.statuses()[3])
+        
+    def test_blocked_skipped_by_next_broadcast(self):
+        self.run_broadcast()
+        broadcast = Broadcast.objects.create(bot=self.bot, template_text=StartView.template_text)
+        stats, sent_to = self.run_broadcast(broadcast)
+        self.assertEqual([1, 3, 4, 5], sent_to)
+        self.assertEqual(1, stats['skipped'])
+
+    def test_exclude_blocked(self):
+        self.run_broadcast()
+        broadcast = Broadcast.objects.create(bot=self.bot, template_text=StartView.template_text)
+        engine = BroadcastEngine(broadcast)
+        self.assertEqual([1, 3, 4, 5], list(engine.exclude_blocked(Chat.objects.order_by('id'))
+                                            .values_list('id', flat=True)))
+        
+    def test_rendered_once_per_context(self):
+        get_context = mock.Mock(return_value={})
+        stats, sent_to = self.run_broadcast(get_context=get_context, context_key=lambda chat_id: chat_id % 2)
+        self.assertEqual(2, get_context.call_count)
+        
+    def test_command(self):
+        AuthTokenFactory(chat_api=Chat.objects.get(id=4))
+        out = StringIO()
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            call_command('telegrambot_broadcast', bot=self.bot.token, template_text=StartView.template_text,
+                         authenticated=True, stdout=out)
+        self.assertEqual(4, mock_send.call_args[1]['chat_id'])
+        self.assertEqual(1, mock_send.call_count)
+        self.assertIn('1 sent', out.getvalue())
+        
+    def test_command_resume_authenticated(self):
+        AuthTokenFactory(chat_api=Chat.objects.get(id=4))
+        broadcast = Broadcast.objects.create(bot=self.bot, template_text=StartView.template_text,
+                                             authenticated_only=True)
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            call_command('telegrambot_broadcast', resume=broadcast.pk, stdout=StringIO())
+        self.assertEqual(1, mock_send.call_count)
+        self.assertEqual(4, mock_send.call_args[1]['chat_id'])
+        
+    def test_command_resume_other_chats(self):
+        self.assertRaises(CommandError, call_command, 'telegrambot_broadcast', resume=self.broadcast.pk,
+                          authenticated=True, stdout=StringIO())
         
 class TestBotRegex(testcases.BaseTestBot):
               
@@ -217,6 +1063,10 @@ class TestLoginRequiredBotView(testcases.BaseTestBot):
                                             'text': "Select from list:\nauthor_1"
                                             }
                                     }
+
+    def setUp(self):
+        super(TestLoginRequiredBotView, self).setUp()
+        caches['default'].clear()
       
     def test_login_required_not_auth(self):
         AuthorFactory(name="author_1")
@@ -241,6 +1091,260 @@ class TestLoginRequiredBotView(testcases.BaseTestBot):
         AuthorFactory(name="author_1")
         self._test_message_ok(self.author_login_required_not_auth)
         
+class TestAuthCache(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestAuthCache, self).setUp()
+        caches['default'].clear()
+        AuthorFactory(name="author_1")
+        self.bot.save()
+        self.chat, _ = Chat.objects.get_or_create(**self.update.message.chat.to_dict())
+
+    def link(self):
+        token = factories.AuthTokenFactory()
+        token.chat_api = self.chat
+        token.save()
+        return token
+
+    def test_cached_state(self):
+        self.link()
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+
+    def test_protected_command_queries(self):
+        self.link()
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        with mock.patch.object(self.bot, 'send_message'):
+            self.update.message.text = '/author_auth'
+            #  Only the query of the view itself
+            with self.assertNumQueries(1):
+                self.bot.handle(self.update)
+
+    def test_not_authenticated_no_bot_query(self):
+        self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+        with mock.patch.object(self.bot, 'send_message') as send_message:
+            self.update.message.text = '/author_auth'
+            with self.assertNumQueries(0):
+                self.bot.handle(self.update)
+        self.assertIn(self.bot.user_api.username, send_message.call_args[1]['text'])
+
+    def test_link_invalidates(self):
+        token = factories.AuthTokenFactory()
+        token.save()
+        self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+        persistence.link_token(token.key, self.chat.id)
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+
+    def test_link_invalidates_previous_chat(self):
+        token = self.link()
+        other = Chat.objects.create(id=self.chat.id + 1, type='private')
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        persistence.link_token(token.key, other.id)
+        self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+        self.assertTrue(auth_cache.is_authenticated(other.id))
+
+    def test_delete_invalidates(self):
+        token = self.link()
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        token.delete()
+        self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+
+    def test_expiration_setting(self):
+        self.link()
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        with override_settings(TELEGRAM_BOT_TOKEN_EXPIRATION='-1'):
+            self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+
+    @override_settings(USE_TZ=False, TIME_ZONE='America/Chicago', TELEGRAM_BOT_TOKEN_EXPIRATION='2')
+    def test_naive_dates(self):
+        token = self.link()
+        AuthToken.objects.filter(pk=token.pk).update(created=timezone.now() - timedelta(minutes=90))
+        caches['default'].clear()
+        self.assertTrue(auth_cache.is_authenticated(self.chat.id))
+        self.assertFalse(AuthToken.objects.get(pk=token.pk).expired())
+        AuthToken.objects.filter(pk=token.pk).update(created=timezone.now() - timedelta(minutes=150))
+        caches['default'].clear()
+        self.assertFalse(auth_cache.is_authenticated(self.chat.id))
+        self.assertTrue(AuthToken.objects.get(pk=token.pk).expired())
+
+
+class TestTokenCleanup(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestTokenCleanup, self).setUp()
+        caches['default'].clear()
+        self.tokens = [factories.AuthTokenFactory() for _ in range(5)]
+        AuthToken.objects.filter(pk__in=[token.pk for token in self.tokens[:3]]).update(
+            created=timezone.now() - timedelta(hours=48))
+
+    def test_delete_expired(self):
+        self.assertEqual(3, AuthToken.objects.delete_expired(batch_size=2))
+        self.assertEqual(set(token.pk for token in self.tokens[3:]),
+                         set(AuthToken.objects.values_list('pk', flat=True)))
+
+    def test_delete_expired_max_batches(self):
+        self.assertEqual(2, AuthToken.objects.delete_expired(batch_size=2, max_batches=1))
+        self.assertEqual(3, AuthToken.objects.count())
+
+    def test_command(self):
+        out = StringIO()
+        call_command('telegrambot_clean_tokens', batch_size=2, stdout=out)
+        self.assertIn("Deleted 3 expired tokens", out.getvalue())
+        self.assertEqual(2, AuthToken.objects.count())
+
+    def test_periodically_disabled(self):
+        self.assertEqual(0, AuthToken.objects.delete_expired_periodically())
+        self.assertEqual(5, AuthToken.objects.count())
+
+    @override_settings(TELEGRAM_BOT_TOKEN_CLEANUP_INTERVAL=60)
+    def test_periodically(self):
+        self.assertEqual(3, AuthToken.objects.delete_expired_periodically())
+        AuthToken.objects.update(created=timezone.now() - timedelta(hours=48))
+        #  Within the interval
+        self.assertEqual(0, AuthToken.objects.delete_expired_periodically())
+        self.assertEqual(2, AuthToken.objects.count())
+
+    @override_settings(TELEGRAM_BOT_TOKEN_CLEANUP_INTERVAL=60, TELEGRAM_BOT_TOKEN_CLEANUP_BATCH_SIZE=2)
+    def test_periodically_bounded(self):
+        self.assertEqual(2, AuthToken.objects.delete_expired_periodically())
+        self.assertEqual(3, AuthToken.objects.count())
+
+
+class TestRetention(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestRetention, self).setUp()
+        user = User.objects.create(id=1, first_name='user')
+        chat = Chat.objects.create(id=1, type='private')
+        now = timezone.now()
+        for i in range(10):
+            message = Message.objects.create(message_id=i + 1, from_user=user, chat=chat, text='text %d' % i,
+                                             date=now - timedelta(days=10 - i) + timedelta(hours=1))
+            Update.objects.create(update_id=i + 100, message=message)
+
+    def remaining(self):
+        return list(Message.objects.order_by('date').values_list('pk', flat=True))
+
+    def test_no_policy(self):
+        self.assertEqual({'messages': 0, 'updates': 0}, retention.prune())
+        self.assertEqual(10, Message.objects.count())
+
+    def test_max_age(self):
+        stats = retention.prune(max_age=5, batch_size=2)
+        self.assertEqual({'messages': 5, 'updates': 5}, stats)
+        self.assertEqual(list(range(6, 11)), self.remaining())
+        self.assertEqual(5, Update.objects.count())
+
+    def test_max_rows(self):
+        retention.prune(max_rows=3, batch_size=4)
+        self.assertEqual([8, 9, 10], self.remaining())
+
+    def test_policies_combined(self):
+        retention.prune(max_age=5, max_rows=7)
+        self.assertEqual(list(range(6, 11)), self.remaining())
+
+    def test_max_batches(self):
+        self.assertEqual(4, retention.prune(max_age=5, batch_size=2, max_batches=2)['messages'])
+        self.assertEqual(list(range(5, 11)), self.remaining())
+
+    def test_archive(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        out = StringIO()
+        call_command('telegrambot_prune', max_age=8, archive_dir=directory, batch_size=1, stdout=out)
+        self.assertIn("Pruned 2 messages and 2 updates", out.getvalue())
+        path = os.path.join(directory, os.listdir(directory)[0])
+        with gzip.open(path, 'rb') as archive:
+            rows = [json.loads(line.decode('utf-8')) for line in archive]
+        self.assertEqual(['message', 'update', 'message', 'update'], [row['model'] for row in rows])
+        self.assertEqual([1, 2], [row['fields']['message_id'] for row in rows if row['model'] == 'message'])
+        self.assertEqual('text 0', rows[0]['fields']['text'])
+        self.assertEqual(1, rows[1]['fields']['message_id'])
+
+    def test_archive_not_overwritten(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for max_age in (8, 6):
+            call_command('telegrambot_prune', max_age=max_age, archive_dir=directory, stdout=StringIO())
+        self.assertEqual(2, len(os.listdir(directory)))
+        path = os.path.join(directory, os.listdir(directory)[0])
+        self.assertRaises(OSError, retention.Archive, path)
+
+    @override_settings(TELEGRAM_BOT_RETENTION={'max_rows': 4})
+    def test_command_settings(self):
+        out = StringIO()
+        call_command('telegrambot_prune', stdout=out)
+        self.assertIn("Pruned 6 messages and 6 updates", out.getvalue())
+
+    def test_command_no_policy(self):
+        with self.assertRaises(CommandError):
+            call_command('telegrambot_prune', stdout=StringIO())
+
+
+class TestChatHistory(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestChatHistory, self).setUp()
+        user = User.objects.create(id=1, first_name='user')
+        self.chat = Chat.objects.create(id=1, type='private')
+        other = Chat.objects.create(id=2, type='private')
+        now = timezone.now()
+        for i in range(1, 8):
+            #  Two messages per date, ordered by id
+            Message.objects.create(message_id=i, from_user=user, chat=self.chat, date=now + timedelta(seconds=i // 2))
+            Message.objects.create(message_id=100 + i, from_user=user, chat=other, date=now)
+
+    def ids(self, messages):
+        return [message.message_id for message in messages]
+
+    def test_history(self):
+        self.assertEqual([7, 6, 5], self.ids(Message.objects.history(self.chat, limit=3)))
+
+    def test_history_before_message(self):
+        page = list(Message.objects.history(self.chat, limit=3))
+        self.assertEqual([4, 3, 2], self.ids(Message.objects.history(self.chat, before=page[-1], limit=3)))
+
+    def test_history_before_pair(self):
+        message = Message.objects.get(pk=5)
+        self.assertEqual([4, 3], self.ids(Message.objects.history(self.chat, (message.date, 5), 2)))
+
+    def test_history_before_date(self):
+        message = Message.objects.get(pk=4)
+        self.assertEqual([3, 2, 1], self.ids(Message.objects.history(self.chat, message.date)))
+
+    def test_iter_history(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(list(range(7, 0, -1)), self.ids(Message.objects.iter_history(self.chat, batch_size=3)))
+
+
+class TestAdminPaginator(testcases.BaseTestBot):
+
+    def setUp(self):
+        super(TestAdminPaginator, self).setUp()
+        self.estimate = mock.patch('telegrambot.admin.estimated_rows', return_value=500000)
+
+    def test_count(self):
+        self.assertIsNone(estimated_rows(connections['default'], Bot._meta.db_table))
+        self.assertEqual(1, EstimatedCountPaginator(Bot.objects.all(), 10).count)
+
+    def test_estimate(self):
+        with self.estimate as estimate:
+            paginator = EstimatedCountPaginator(Bot.objects.all(), 10)
+            self.assertEqual(500000, paginator.count)
+            self.assertEqual(50000, paginator.num_pages)
+        estimate.assert_called_once_with(connections['default'], Bot._meta.db_table)
+
+    def test_filtered_counted(self):
+        with self.estimate as estimate:
+            self.assertEqual(1, EstimatedCountPaginator(Bot.objects.filter(enabled=True), 10).count)
+        self.assertFalse(estimate.called)
+
+    def test_small_table_counted(self):
+        with self.estimate, mock.patch('telegrambot.admin.ESTIMATE_THRESHOLD', 1000000):
+            self.assertEqual(1, EstimatedCountPaginator(Bot.objects.all(), 10).count)
+
+
 class TestAuthView(testcases.BaseTestBot):  
     
     user_args = {'username': 'username',
@@ -284,4 +1388,359 @@ class TestAuthView(testcases.BaseTestBot):
         self._test_message_ok(start_authenticated)
         self.assertEqual(AuthToken.objects.count(), 1)
         token = AuthToken.objects.all()[0]
-        self.assertEqual(token.chat_api.id, self.update.message.chat.id)
\ No newline at end of file
+        self.assertEqual(token.chat_api.id, self.update.message.chat.id)
+
+class TestWorkerPool(testcases.BaseTestBot):
+    
+    def test_process_jobs(self):
+        processed = []
+        pool = WorkerPool(workers=2, queue_size=10, target=processed.append)
+        pool.start()
+        for i in range(5):
+            self.assertTrue(pool.submit(i))
+        pool.join()
+        pool.stop()
+        self.assertEqual(sorted(processed), list(range(5)))
+        self.assertEqual(5, pool.stats()['processed'])
+        self.assertEqual(0, pool.stats()['queue_depth'])
+        
+    def test_failed_jobs(self):
+        def fail(job):
+            raise ValueError(job)
+        pool = WorkerPool(workers=1, queue_size=10, target=fail)
+        pool.start()
+        pool.submit(1)
+        pool.join()
+        pool.stop()
+        self.assertEqual(1, pool.stats()['failed'])
+        
+    def test_queue_full(self):
+        pool = WorkerPool(workers=1, queue_size=1)
+        self.assertTrue(pool.submit(1))
+        self.assertFalse(pool.submit(2))
+        self.assertEqual(1, pool.qsize())
+        
+    def test_stop_drains_queue(self):
+        processed = []
+        pool = WorkerPool(workers=1, queue_size=10, target=lambda job: processed.append(time.sleep(0.01) or job))
+        pool.start()
+        for i in range(5):
+            pool.submit(i)
+        pool.stop()
+        self.assertEqual(list(range(5)), processed)
+        
+    def test_stopped_at_exit(self):
+        with mock.patch("telegrambot.ingestion._pool", None), mock.patch("telegrambot.ingestion.atexit") as mock_atexit:
+            pool = ingestion.get_pool()
+            mock_atexit.register.assert_called_once_with(pool.stop)
+            pool.stop()
+        
+
+@override_settings(TELEGRAM_BOT_INGESTION='threads')
+class TestThreadsIngestion(testcases.BaseTestBot):
+    
+    def test_enqueue(self):
+        with mock.patch("telegrambot.ingestion.get_pool") as mock_pool:
+            mock_pool.return_value.submit.return_value = True
+            with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+                response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+            self.assertEqual(status.HTTP_200_OK, response.status_code)
+            self.assertEqual(0, mock_send.call_count)
+            self.assertEqual(0, Update.objects.count())
+            args, kwargs = mock_pool.return_value.submit.call_args
+            self.assertEqual(self.bot.token, args[0])
+            self.assertEqual(self.update.update_id, args[1]['update_id'])
+            
+    def test_queue_full(self):
+        with mock.patch("telegrambot.ingestion.get_pool") as mock_pool:
+            mock_pool.return_value.submit.return_value = False
+            response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+            self.assertEqual(status.HTTP_503_SERVICE_UNAVAILABLE, response.status_code)
+            
+    def test_no_bot_associated(self):
+        Bot.objects.all().delete()
+        response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        self.assertEqual(status.HTTP_404_NOT_FOUND, response.status_code)
+    
+    def test_not_valid_update(self):
+        del self.update.message
+        response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        self.assertEqual(status.HTTP_400_BAD_REQUEST, response.status_code)
+        
+
+@override_settings(TELEGRAM_BOT_INGESTION='queue', TELEGRAM_BOT_QUEUE_MAX_ATTEMPTS=3)
+class TestQueueIngestion(testcases.BaseTestBot):
+    
+    def test_enqueue_and_process(self):
+        self.update.message.text = '/start'
+        response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+        self.assertEqual(status.HTTP_200_OK, response.status_code)
+        self.assertEqual(1, QueuedUpdate.objects.count())
+        self.assertEqual(0, Update.objects.count())
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            call_command('telegrambot_worker', workers=0, once=True)
+            self.assertBotResponse(mock_send, TestBotCommands.start)
+        self.assertEqual(0, QueuedUpdate.objects.count())
+        self.assertUpdate(Update.objects.get(update_id=self.update.update_id), self.update)
+
+    def queue(self):
+        ingestion.enqueue_update(self.bot.token, json.loads(self.update.to_json()))
+        return QueuedUpdate.objects.get()
+
+    def test_failed_update_kept(self):
+        self.queue()
+        with mock.patch("telegrambot.models.Bot.handle", side_effect=ValueError):
+            call_command('telegrambot_worker', workers=0, once=True)
+        queued = QueuedUpdate.objects.get()
+        self.assertIsNone(queued.claimed_at)
+        self.assertEqual(settings.TELEGRAM_BOT_QUEUE_MAX_ATTEMPTS, queued.attempts)
+        #  Left for inspection
+        self.assertEqual([], ingestion.claim_queued_updates(10))
+
+    def test_claimed_skipped(self):
+        queued = self.queue()
+        self.assertEqual([queued.pk], [pk for pk, _, _ in ingestion.claim_queued_updates(10)])
+        self.assertEqual([], ingestion.claim_queued_updates(10))
+
+    def test_stale_claim_taken_over(self):
+        queued = self.queue()
+        QueuedUpdate.objects.filter(pk=queued.pk).update(claimed_at=timezone.now() - timedelta(seconds=301),
+                                                         attempts=1)
+        self.assertEqual([queued.pk], [pk for pk, _, _ in ingestion.claim_queued_updates(10)])
+        self.assertEqual(2, QueuedUpdate.objects.get().attempts)
+
+
+class TestBotRegistry(testcases.BaseTestBot):
+    
+    def test_cached_bot(self):
+        bot = registry.get(self.bot.token)
+        self.assertEqual(bot.pk, self.bot.pk)
+        with self.assertNumQueries(0):
+            self.assertIs(bot, registry.get(self.bot.token))
+            self.assertEqual(bot.user_api.username, self.bot.user_api.username)
+            
+    def test_load(self):
+        registry.clear()
+        self.assertEqual(1, registry.load())
+        self.assertIn(self.bot.token, registry)
+            
+    def test_invalidate_on_save(self):
+        registry.get(self.bot.token)
+        with mock.patch("telegram.bot.Bot.setWebhook", callable=mock.MagicMock()):
+            self.bot.enabled = False
+            self.bot.save()
+        self.assertNotIn(self.bot.token, registry)
+        self.assertRaises(Bot.DoesNotExist, registry.get, self.bot.token)
+        
+    def test_invalidate_on_delete(self):
+        registry.get(self.bot.token)
+        self.bot.delete()
+        self.assertNotIn(self.bot.token, registry)
+        self.assertRaises(Bot.DoesNotExist, registry.get, self.bot.token)
+
+
+class TestDecodeUpdate(testcases.BaseTestBot):
+    
+    def test_decode(self):
+        update = decode_update(self.update.to_json())
+        self.assertEqual(update.update_id, self.update.update_id)
+        self.assertEqual(update.message.text, self.update.message.text)
+        self.assertEqual(update.message.chat.id, self.update.message.chat.id)
+        self.assertEqual(update.message.from_user.id, self.update.message.from_user.id)
+        
+    def test_decode_dict(self):
+        update = decode_update(codec.loads(self.update.to_json()))
+        data = update_data(update)
+        self.assertEqual(data['update_id'], self.update.update_id)
+        self.assertEqual(data['message']['from_user']['username'], self.update.message.from_user.username)
+        self.assertEqual(data['message']['chat']['title'], self.update.message.chat.title)
+        
+    def test_missing_fields(self):
+        data = codec.loads(self.update.to_json())
+        del data['message']['chat']['type']
+        del data['message']['date']
+        with self.assertRaises(UpdateDecodeError) as cm:
+            decode_update(data)
+        self.assertEqual(cm.exception.errors, {'message': {'chat': {'type': ['This field is required.']},
+                                                           'date': ['This field is required.']}})
+        
+    def test_malformed_fields(self):
+        data = codec.loads(self.update.to_json())
+        data['update_id'] = 'abc'
+        data['message']['from'] = 1
+        data['message']['chat'] = {'id': '1', 'type': 'private'}
+        data['message']['date'] = '2016-01-01'
+        data['message']['message_id'] = True
+        with self.assertRaises(ValidationError) as cm:
+            decode_update(data)
+        self.assertEqual(cm.exception.errors, {'update_id': ['A valid integer is required.'],
+                                               'message': {'from': ['Invalid data. Expected a dictionary.'],
+                                                           'chat': {'id': ['A valid integer is required.']},
+                                                           'date': ['A valid integer is required.'],
+                                                           'message_id': ['A valid integer is required.']}})
+        
+    def test_invalid_json(self):
+        self.assertRaises(UpdateDecodeError, decode_update, '{"update_id": ')
+        self.assertRaises(UpdateDecodeError, decode_update, '[]')
+
+
+class TestPersistence(testcases.BaseTestBot):
+    
+    start = TestBotCommands.start
+    
+    def test_changed_chat_updated(self):
+        self._test_message_ok(self.start)
+        update_2 = factories.UpdateLibFactory()
+        update_2.message.from_user = self.update.message.from_user
+        update_2.message.chat = self.update.message.chat
+        update_2.message.chat.title = 'new title'
+        self._test_message_ok(self.start, update_2, 2)
+        self.assertEqual('new title', Chat.objects.get(id=update_2.message.chat.id).title)
+        
+    def test_repeated_update(self):
+        data = update_data(self.update)
+        persistence.save_update(data)
+        persistence.save_update(data)
+        self.assertEqual(1, Update.objects.count())
+        self.assertUpdate(Update.objects.get(update_id=self.update.update_id), self.update)
+        
+    def test_without_upsert(self):
+        with mock.patch("telegrambot.persistence.supports_upsert", return_value=False):
+            self.test_changed_chat_updated()
+
+
+class TestWriteBehind(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestWriteBehind, self).setUp()
+        self.buffer = WriteBehindBuffer(max_size=100, max_delay=60)
+        
+    def conversation_update(self):
+        update = factories.UpdateLibFactory()
+        update.message.from_user = self.update.message.from_user
+        update.message.chat = self.update.message.chat
+        return update
+        
+    def test_flush(self):
+        self.buffer.add(update_data(self.update))
+        self.buffer.add(update_data(self.conversation_update()))
+        self.assertEqual(6, self.buffer.pending())
+        self.assertEqual(0, Update.objects.count())
+        self.assertEqual(6, self.buffer.flush())
+        self.assertEqual(0, self.buffer.pending())
+        self.assertEqual(2, Update.objects.count())
+        self.assertUpdate(Update.objects.get(update_id=self.update.update_id), self.update)
+        
+    def test_flush_on_stop(self):
+        self.buffer.add(update_data(self.update))
+        self.buffer.stop()
+        self.assertEqual(0, self.buffer.pending())
+        self.assertEqual(1, Update.objects.count())
+        
+    def test_size_limit_wakes_flusher(self):
+        self.buffer.max_size = 8
+        self.buffer.add(update_data(self.update))
+        self.assertFalse(self.buffer._wakeup.is_set())
+        self.buffer.add(update_data(self.conversation_update()))
+        self.buffer.add(update_data(self.conversation_update()))
+        self.assertTrue(self.buffer._wakeup.is_set())
+        
+    def test_start_token_written_now(self):
+        token = factories.AuthTokenFactory()
+        self.update.message.text = '/start %s' % token.key
+        self.buffer.add(update_data(self.update))
+        self.assertEqual(0, self.buffer.pending())
+        self.assertEqual(self.update.message.chat.id, AuthToken.objects.get(key=token.key).chat_api_id)
+        
+    def test_webhook(self):
+        with mock.patch("telegrambot.persistence.get_buffer", return_value=self.buffer):
+            with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+                self.update.message.text = '/start'
+                response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertBotResponse(mock_send, TestBotCommands.start)
+        self.assertEqual(0, Update.objects.count())
+        self.buffer.flush()
+        self.assertUpdate(Update.objects.get(update_id=self.update.update_id), self.update)
+        
+    def test_without_upsert(self):
+        with mock.patch("telegrambot.persistence.supports_upsert", return_value=False):
+            self.test_flush()
+
+    def test_without_upsert_changed_rows_written(self):
+        with mock.patch("telegrambot.persistence.supports_upsert", return_value=False):
+            self.buffer.add(update_data(self.update))
+            self.buffer.flush()
+            update = self.conversation_update()
+            update.message.from_user.first_name = 'renamed'
+            update.message.chat.title = 'new title'
+            self.buffer.add(update_data(update))
+            self.buffer.flush()
+        self.assertEqual('renamed', User.objects.get(id=update.message.from_user.id).first_name)
+        self.assertEqual('new title', Chat.objects.get(id=update.message.chat.id).title)
+
+    def test_failed_batch_kept(self):
+        bulk_save = persistence.bulk_save
+        poisoned = self.conversation_update()
+
+        def failing(users, chats, messages, updates):
+            if len(updates) > 1 or updates[0].update_id == poisoned.update_id or self.down:
+                raise ValueError
+            bulk_save(users, chats, messages, updates)
+        self.buffer.add(update_data(self.update))
+        self.buffer.add(update_data(poisoned))
+        self.buffer.add(update_data(self.conversation_update()))
+        with mock.patch("telegrambot.persistence.bulk_save", side_effect=failing):
+            self.down = True
+            self.assertEqual(0, self.buffer.flush())
+            self.assertEqual(8, self.buffer.pending())
+            self.down = False
+            self.assertEqual(6, self.buffer.flush())
+            self.assertEqual(2, Update.objects.count())
+            for _ in range(self.buffer.max_attempts - 2):
+                self.assertEqual(0, self.buffer.flush())
+            self.assertEqual(0, self.buffer.pending())
+        self.assertEqual(2, self.buffer.failed)
+        self.assertFalse(Update.objects.filter(update_id=poisoned.update_id).exists())
+
+
+class TestDeduplication(testcases.BaseTestBot):
+    
+    def setUp(self):
+        super(TestDeduplication, self).setUp()
+        self.deduplicator = UpdateDeduplicator(size=10)
+        patcher = mock.patch("telegrambot.views.get_deduplicator", return_value=self.deduplicator)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_retried_update_not_handled_twice(self):
+        self._test_message_ok(TestBotCommands.start)
+        with mock.patch("telegram.bot.Bot.sendMessage", callable=mock.MagicMock()) as mock_send:
+            with self.assertNumQueries(0):
+                response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(0, mock_send.call_count)
+        self.assertEqual(1, self.deduplicator.duplicates)
+        
+    def test_failed_update_handled_again(self):
+        self.update.message.text = '/start'
+        with mock.patch("telegrambot.models.Bot.handle", side_effect=ValueError):
+            response = self.client.post(self.webhook_url, self.update.to_json(), **self.kwargs)
+            self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self._test_message_ok(TestBotCommands.start)
+        self.assertEqual(0, self.deduplicator.duplicates)
+        
+    def test_same_update_id_other_bot(self):
+        self.assertTrue(self.deduplicator.claim('token_1', 1))
+        self.assertTrue(self.deduplicator.claim('token_2', 1))
+        self.assertFalse(self.deduplicator.claim('token_1', 1))
+        
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_shared_cache(self):
+        other_process = UpdateDeduplicator(size=10, cache='default')
+        deduplicator = UpdateDeduplicator(size=10, cache='default')
+        self.assertTrue(other_process.claim('token', 1))
+        self.assertFalse(deduplicator.claim('token', 1))
+        self.assertEqual(1, deduplicator.duplicates)
+        other_process.release('token', 1)
+        self.assertTrue(deduplicator.claim('token', 1))